@@ -0,0 +1,33 @@
+"""add unique constraint on solved katas
+
+Revision ID: 7a3c1e5d9b42
+Revises: 9e2ac179308f
+Create Date: 2026-10-18 15:40:12.481233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3c1e5d9b42'
+down_revision = '9e2ac179308f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # drop duplicated solutions left by the per-kata ingestion before
+    # enforcing uniqueness
+    op.execute("""
+        DELETE FROM solved_katas AS duplicate
+        USING solved_katas AS original
+        WHERE duplicate.user_id = original.user_id
+            AND duplicate.kata_id = original.kata_id
+            AND duplicate.id > original.id;
+    """)
+    op.create_unique_constraint('uq_solved_katas_user_id_kata_id', 'solved_katas', ['user_id', 'kata_id'])
+
+
+def downgrade():
+    op.drop_constraint('uq_solved_katas_user_id_kata_id', 'solved_katas', type_='unique')
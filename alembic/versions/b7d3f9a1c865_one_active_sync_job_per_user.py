@@ -0,0 +1,36 @@
+"""one active sync job per user
+
+Revision ID: b7d3f9a1c865
+Revises: a6c2e8f3b754
+Create Date: 2026-10-18 21:02:13.457920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3f9a1c865'
+down_revision = 'a6c2e8f3b754'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keep the oldest of the duplicate active jobs
+    op.execute("""
+        UPDATE sync_jobs
+        SET status = 'failed', error = 'duplicate'
+        WHERE status IN ('queued', 'running') AND id NOT IN (
+            SELECT MIN(id)
+            FROM sync_jobs
+            WHERE status IN ('queued', 'running')
+            GROUP BY user_id
+        );
+    """)
+    op.create_index('uq_sync_jobs_active_user_id', 'sync_jobs', ['user_id'], unique=True,
+                    postgresql_where=sa.text("status IN ('queued', 'running')"))
+
+
+def downgrade():
+    op.drop_index('uq_sync_jobs_active_user_id', table_name='sync_jobs')
@@ -0,0 +1,81 @@
+"""add cohorts keyed by chat, keep mentor stats per cohort
+
+Revision ID: c8e4a2b6d917
+Revises: b7d3f9a1c865
+Create Date: 2026-10-18 21:58:40.716382
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e4a2b6d917'
+down_revision = 'b7d3f9a1c865'
+branch_labels = None
+depends_on = None
+
+# keep in line with MENTOR_STATS_WINDOW
+WINDOW = 10
+
+# (table, foreign key action) of every table partitioned by cohort
+TABLES = (
+    ('users', 'SET NULL'),
+    ('rounds', 'CASCADE'),
+    ('pairs', 'CASCADE'),
+    ('feedbacks', 'SET NULL'),
+)
+
+
+def upgrade():
+    for table, ondelete in TABLES:
+        op.add_column(table, sa.Column('cohort_id', sa.BigInteger(), nullable=True))
+        op.create_foreign_key(f'{table}_cohort_id_fkey', table, 'chats', ['cohort_id'], ['id'], ondelete=ondelete)
+        # everything so far belongs to the chat the bot was set up in
+        op.execute(f"""
+            UPDATE {table}
+            SET cohort_id = (SELECT id FROM chats ORDER BY created_at, id LIMIT 1);
+        """)
+    op.create_index('ix_users_cohort_id_is_mentor', 'users', ['cohort_id', 'is_mentor'], unique=False)
+    op.create_index('ix_rounds_cohort_id_id', 'rounds', ['cohort_id', 'id'], unique=False)
+    op.create_index('ix_pairs_cohort_id_mentee_id_mentor_id', 'pairs', ['cohort_id', 'mentee_id', 'mentor_id'],
+                    unique=False)
+    op.create_index('ix_feedbacks_cohort_id_mentor_id', 'feedbacks', ['cohort_id', 'mentor_id'], unique=False)
+    # mentor statistics are kept per cohort, rebuilt from the feedbacks
+    op.execute("DELETE FROM mentor_stats;")
+    op.drop_constraint('mentor_stats_pkey', 'mentor_stats', type_='primary')
+    op.add_column('mentor_stats', sa.Column('cohort_id', sa.BigInteger(), nullable=False))
+    op.create_foreign_key('mentor_stats_cohort_id_fkey', 'mentor_stats', 'chats', ['cohort_id'], ['id'],
+                          ondelete='CASCADE')
+    op.create_primary_key('mentor_stats_pkey', 'mentor_stats', ['cohort_id', 'mentor_id'])
+    op.execute(f"""
+        INSERT INTO mentor_stats (cohort_id, mentor_id, count, mean, m2, recent)
+        SELECT cohort_id, mentor_id, COUNT(rate), AVG(rate), VAR_POP(rate) * COUNT(rate),
+            (ARRAY_AGG(rate ORDER BY created_at DESC, id DESC))[1:{WINDOW}]
+        FROM feedbacks
+        WHERE cohort_id IS NOT NULL AND mentor_id IS NOT NULL AND rate IS NOT NULL
+        GROUP BY cohort_id, mentor_id;
+    """)
+
+
+def downgrade():
+    op.execute("DELETE FROM mentor_stats;")
+    op.drop_constraint('mentor_stats_pkey', 'mentor_stats', type_='primary')
+    op.drop_constraint('mentor_stats_cohort_id_fkey', 'mentor_stats', type_='foreignkey')
+    op.drop_column('mentor_stats', 'cohort_id')
+    op.create_primary_key('mentor_stats_pkey', 'mentor_stats', ['mentor_id'])
+    op.execute(f"""
+        INSERT INTO mentor_stats (mentor_id, count, mean, m2, recent)
+        SELECT mentor_id, COUNT(rate), AVG(rate), VAR_POP(rate) * COUNT(rate),
+            (ARRAY_AGG(rate ORDER BY created_at DESC, id DESC))[1:{WINDOW}]
+        FROM feedbacks
+        WHERE mentor_id IS NOT NULL AND rate IS NOT NULL
+        GROUP BY mentor_id;
+    """)
+    op.drop_index('ix_feedbacks_cohort_id_mentor_id', table_name='feedbacks')
+    op.drop_index('ix_pairs_cohort_id_mentee_id_mentor_id', table_name='pairs')
+    op.drop_index('ix_rounds_cohort_id_id', table_name='rounds')
+    op.drop_index('ix_users_cohort_id_is_mentor', table_name='users')
+    for table, _ in reversed(TABLES):
+        op.drop_constraint(f'{table}_cohort_id_fkey', table, type_='foreignkey')
+        op.drop_column(table, 'cohort_id')
@@ -0,0 +1,27 @@
+"""add indexes for hot queries
+
+Revision ID: d5f1b3a8c6e4
+Revises: c2e9a4f7b311
+Create Date: 2026-10-18 18:02:44.530981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f1b3a8c6e4'
+down_revision = 'c2e9a4f7b311'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the latest round is indexed by the rounds migration that follows
+    op.create_index(op.f('ix_solved_katas_kata_id'), 'solved_katas', ['kata_id'], unique=False)
+    op.create_index(op.f('ix_feedbacks_mentor_id'), 'feedbacks', ['mentor_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_feedbacks_mentor_id'), table_name='feedbacks')
+    op.drop_index(op.f('ix_solved_katas_kata_id'), table_name='solved_katas')
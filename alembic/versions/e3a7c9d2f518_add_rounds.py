@@ -0,0 +1,61 @@
+"""add rounds, key pairs on the round id
+
+Revision ID: e3a7c9d2f518
+Revises: d5f1b3a8c6e4
+Create Date: 2026-10-18 19:11:08.214635
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a7c9d2f518'
+down_revision = 'd5f1b3a8c6e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rounds',
+                    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+                    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.add_column('pairs', sa.Column('round_id', sa.Integer(), nullable=True))
+    # pairs of a shuffle were told apart by their creation date, so every
+    # distinct date becomes a round, numbered in date order
+    op.execute("""
+        CREATE TEMPORARY TABLE round_numbers AS
+        SELECT COALESCE(created_at::date, CURRENT_DATE) AS round_date,
+            ROW_NUMBER() OVER (ORDER BY COALESCE(created_at::date, CURRENT_DATE)) AS id,
+            MIN(created_at) AS created_at
+        FROM pairs
+        GROUP BY COALESCE(created_at::date, CURRENT_DATE);
+    """)
+    op.execute("""
+        INSERT INTO rounds (id, created_at, updated_at)
+        SELECT id, created_at, created_at
+        FROM round_numbers;
+    """)
+    op.execute("""
+        UPDATE pairs
+        SET round_id = round_numbers.id
+        FROM round_numbers
+        WHERE COALESCE(pairs.created_at::date, CURRENT_DATE) = round_numbers.round_date;
+    """)
+    op.execute("DROP TABLE round_numbers;")
+    op.execute("SELECT setval(pg_get_serial_sequence('rounds', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM rounds;")
+    op.alter_column('pairs', 'round_id', nullable=False)
+    op.create_foreign_key('pairs_round_id_fkey', 'pairs', 'rounds', ['round_id'], ['id'], ondelete='CASCADE')
+    op.create_index('ix_pairs_round_id_mentor_id', 'pairs', ['round_id', 'mentor_id'], unique=False)
+    op.create_index('ix_pairs_round_id_mentee_id', 'pairs', ['round_id', 'mentee_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_pairs_round_id_mentee_id', table_name='pairs')
+    op.drop_index('ix_pairs_round_id_mentor_id', table_name='pairs')
+    op.drop_constraint('pairs_round_id_fkey', 'pairs', type_='foreignkey')
+    op.drop_column('pairs', 'round_id')
+    op.drop_table('rounds')
@@ -0,0 +1,46 @@
+"""add mentor stats
+
+Revision ID: f4b8d1e6a293
+Revises: e3a7c9d2f518
+Create Date: 2026-10-18 19:48:27.603514
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b8d1e6a293'
+down_revision = 'e3a7c9d2f518'
+branch_labels = None
+depends_on = None
+
+# keep in line with MENTOR_STATS_WINDOW
+WINDOW = 10
+
+
+def upgrade():
+    op.create_table('mentor_stats',
+                    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+                    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+                    sa.Column('mentor_id', sa.Integer(), nullable=False),
+                    sa.Column('count', sa.Integer(), server_default='0', nullable=False),
+                    sa.Column('mean', sa.Float(), server_default='0', nullable=False),
+                    sa.Column('m2', sa.Float(), server_default='0', nullable=False),
+                    sa.Column('recent', postgresql.ARRAY(sa.Integer()), server_default='{}', nullable=False),
+                    sa.ForeignKeyConstraint(['mentor_id'], ['users.tg_id'], ),
+                    sa.PrimaryKeyConstraint('mentor_id')
+                    )
+    op.execute(f"""
+        INSERT INTO mentor_stats (mentor_id, count, mean, m2, recent)
+        SELECT mentor_id, COUNT(rate), AVG(rate), VAR_POP(rate) * COUNT(rate),
+            (ARRAY_AGG(rate ORDER BY created_at DESC, id DESC))[1:{WINDOW}]
+        FROM feedbacks
+        WHERE mentor_id IS NOT NULL AND rate IS NOT NULL
+        GROUP BY mentor_id;
+    """)
+
+
+def downgrade():
+    op.drop_table('mentor_stats')
@@ -0,0 +1,139 @@
+"""
+Offline stand-in for the parts of the Codewars API the bot uses.
+
+Serves synthetic profiles, completed-challenge pages and kata metadata::
+
+    python -m benchmarks.codewars_stub --port 8081 --history 2000 --latency 0.05
+
+A user named ``<anything>-<n>`` has ``n`` completions, any other user has
+``--history`` of them. Completions are listed newest first, 200 per page,
+like the real API. Responses carry an ETag and honour If-None-Match, and
+``--error-rate`` injects 429 responses. Request counts per user are exposed
+on ``/_stats``.
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import hashlib
+import json
+import math
+import random
+
+from aiohttp import web
+
+PAGE_SIZE = 200
+EPOCH = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def kata_id(number: int) -> str:
+    return hashlib.sha1(str(number).encode()).hexdigest()[:24]
+
+
+def kata(number: int) -> dict:
+    return {
+        'id': kata_id(number),
+        'name': f'Kata #{number}',
+        'slug': f'kata-{number}',
+    }
+
+
+def catalogue(size: int) -> list:
+    return [kata(number) for number in range(size)]
+
+
+class CodewarsStub:
+
+    def __init__(self, history: int = 500, catalogue_size: int = 5000, latency: float = 0,
+                 error_rate: float = 0, seed: int = 0):
+        self.history = history
+        self.catalogue_size = catalogue_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = collections.Counter()
+
+    def history_size(self, username: str) -> int:
+        _, _, size = username.rpartition('-')
+        return int(size) if size.isdigit() else self.history
+
+    def completions(self, username: str, page: int) -> dict:
+        total = self.history_size(username)
+        start = page * PAGE_SIZE
+        data = []
+        # number 0 is the oldest completion, the newest one comes first
+        for number in range(total - 1 - start, max(total - 1 - start - PAGE_SIZE, -1), -1):
+            completed_at = EPOCH + datetime.timedelta(hours=number)
+            data.append({
+                **kata(number % self.catalogue_size),
+                'completedAt': completed_at.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'completedLanguages': ['python'],
+            })
+        return {
+            'totalPages': math.ceil(total / PAGE_SIZE),
+            'totalItems': total,
+            'data': data,
+        }
+
+    async def respond(self, request: web.Request, username: str, body: dict) -> web.Response:
+        self.requests[username] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            return web.json_response({'success': False, 'reason': 'rate limited'}, status=429,
+                                     headers={'Retry-After': '0'})
+        payload = json.dumps(body)
+        etag = '"{}"'.format(hashlib.md5(payload.encode()).hexdigest())
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=payload, content_type='application/json', headers={'ETag': etag})
+
+    async def handle_user(self, request: web.Request) -> web.Response:
+        username = request.match_info['username']
+        return await self.respond(request, username, {
+            'username': username,
+            'codeChallenges': {'totalAuthored': 0, 'totalCompleted': self.history_size(username)},
+        })
+
+    async def handle_completed(self, request: web.Request) -> web.Response:
+        username = request.match_info['username']
+        page = int(request.query.get('page', 0))
+        return await self.respond(request, username, self.completions(username, page))
+
+    async def handle_challenge(self, request: web.Request) -> web.Response:
+        ref = request.match_info['ref']
+        for number in range(self.catalogue_size):
+            if ref in (kata_id(number), f'kata-{number}'):
+                return await self.respond(request, ref, kata(number))
+        return web.json_response({'success': False, 'reason': 'not found'}, status=404)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.requests))
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/api/v1/users/{username}', self.handle_user)
+        app.router.add_get('/api/v1/users/{username}/code-challenges/completed', self.handle_completed)
+        app.router.add_get('/api/v1/code-challenges/{ref}', self.handle_challenge)
+        app.router.add_get('/_stats', self.handle_stats)
+        return app
+
+
+async def serve(stub: CodewarsStub, host: str = 'localhost', port: int = 8081) -> web.AppRunner:
+    runner = web.AppRunner(stub.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--history', type=int, default=500, help='completions per user')
+    parser.add_argument('--catalogue', type=int, default=5000, help='number of distinct katas')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests answered with 429')
+    args = parser.parse_args()
+    stub = CodewarsStub(args.history, args.catalogue, args.latency, args.error_rate)
+    web.run_app(stub.make_app(), host=args.host, port=args.port)
@@ -0,0 +1,136 @@
+"""
+End-to-end benchmark of the solutions sync pipeline.
+
+Runs the sync against the Codewars stand-in and a local Postgres::
+
+    DATABASE_URI=postgresql://localhost/bench python -m benchmarks.sync_benchmark --users 20 --history 2000
+
+Seeds the catalogue and ``--users`` benchmark users, then measures a full
+sync, an incremental sync with nothing new and the bulk refresh job. Each
+phase reports wall time, DB queries per user and per synced kata, and
+Codewars requests per user. Use a throwaway database: the bulk phase syncs
+every user in it, and benchmark users are removed and seeded again on every
+run.
+"""
+import argparse
+import asyncio
+import os
+import time
+import typing
+
+import asyncpg
+
+from benchmarks.codewars_stub import CodewarsStub, catalogue, serve
+
+# benchmark users get ids from this range
+TG_ID_BASE = 2_100_000_000
+
+
+class CountingConnection(asyncpg.Connection):
+    """
+    Counts round trips of prepared and raw queries alike
+    """
+    queries = 0
+
+    async def _do_execute(self, *args, **kwargs):
+        CountingConnection.queries += 1
+        return await super()._do_execute(*args, **kwargs)
+
+
+def configure(args: argparse.Namespace):
+    # must run before any bot module imports config
+    base = f'http://localhost:{args.port}/api/v1'
+    os.environ['CODEWARS_BASE_URL'] = f'{base}/users'
+    os.environ['CODEWARS_CHALLENGES_URL'] = f'{base}/code-challenges'
+    os.environ.setdefault('CODEWARS_RATE_LIMIT', '0')
+    os.environ.setdefault('CODEWARS_RETRY_BACKOFF', '0.1')
+    for name in ('BOT_TOKEN', 'WEBHOOK_URL', 'WEBHOOK_HOST', 'CREATOR_ID'):
+        os.environ.setdefault(name, '')
+
+
+async def measure(phase: str, run: typing.Callable[[], typing.Awaitable[int]],
+                  stub: CodewarsStub, users: int, katas: int) -> dict:
+    stub.requests.clear()
+    CountingConnection.queries = 0
+    started = time.monotonic()
+    solved = await run()
+    elapsed = time.monotonic() - started
+    queries = CountingConnection.queries
+    return {
+        'phase': phase,
+        'wall time, s': round(elapsed, 3),
+        'new solves': solved,
+        'db queries': queries,
+        'queries / user': round(queries / users, 2),
+        'queries / kata': round(queries / katas, 4) if katas else '-',
+        'http / user': round(sum(stub.requests.values()) / users, 2),
+    }
+
+
+async def run(args: argparse.Namespace):
+    from tabulate import tabulate
+
+    from catalogue import upsert_katas
+    from codewars import codewars
+    from models import POOL_MAX_SIZE, POOL_MIN_SIZE, POSTGRES_URI, SolvedKata, User, db
+    from services import UserService
+
+    stub = CodewarsStub(args.history, args.catalogue, args.latency, args.error_rate)
+    runner = await serve(stub, port=args.port)
+    await db.set_bind(POSTGRES_URI, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                      connection_class=CountingConnection)
+    await db.gino.create_all()
+    try:
+        bench_ids = db.and_(User.tg_id >= TG_ID_BASE, User.tg_id < TG_ID_BASE + args.users)
+        await SolvedKata.delete.where(db.and_(
+            SolvedKata.user_id >= TG_ID_BASE, SolvedKata.user_id < TG_ID_BASE + args.users,
+        )).gino.status()
+        await User.delete.where(bench_ids).gino.status()
+        katas = catalogue(args.catalogue)
+        for start in range(0, len(katas), 1000):
+            await upsert_katas(katas[start:start + 1000])
+        await User.insert().values([
+            dict(tg_id=TG_ID_BASE + num, tg_username=f'bench{num}', cw_username=f'bench{num}-{args.history}')
+            for num in range(args.users)
+        ]).gino.status()
+        users = await User.query.where(bench_ids).gino.all()
+
+        async def sync(full: bool) -> int:
+            solved = 0
+            for user in users:
+                solved += await UserService.extract_solved_katas(user, full=full)
+            return solved
+
+        async def bulk() -> int:
+            return (await UserService.extract_solved_katas_in_bulk()).solved
+
+        total = args.users * args.history
+        results = [
+            await measure('full sync', lambda: sync(full=True), stub, args.users, total),
+            await measure('incremental sync', lambda: sync(full=False), stub, args.users, 0),
+        ]
+        # start the bulk job from scratch
+        await SolvedKata.delete.where(db.and_(
+            SolvedKata.user_id >= TG_ID_BASE, SolvedKata.user_id < TG_ID_BASE + args.users,
+        )).gino.status()
+        await User.update.values(last_completed_at=None, last_completed_kata_id=None).where(bench_ids).gino.status()
+        await codewars.cache.clear()
+        results.append(await measure('bulk refresh', bulk, stub, args.users, total))
+        print(tabulate(results, headers='keys', tablefmt='pretty'))
+    finally:
+        await codewars.close()
+        await db.pop_bind().close()
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--history', type=int, default=1000, help='completions per user')
+    parser.add_argument('--catalogue', type=int, default=5000, help='number of distinct katas')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every stub response')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of stub requests answered with 429')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+    configure(args)
+    asyncio.run(run(args))
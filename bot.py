@@ -1,32 +1,54 @@
 import asyncio
+import io
 import logging
+import typing
 
 import aiogram.utils.markdown as md
-import aiohttp
 import aioschedule
-from aiogram import Bot, Dispatcher, executor, types
+from aiogram import Dispatcher, executor, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.contrib.fsm_storage.redis import RedisStorage2
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters import Text
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import ParseMode
 from aiogram.types.reply_keyboard import KeyboardButton, ReplyKeyboardMarkup
 from aiogram.utils.executor import Executor
+from aiogram.utils.parts import split_text
+from aiohttp import web
 
+from broadcast import broadcast
+from cache import close_redis
+from codewars import codewars
 from config import *
-from models import on_shutdown
+from exceptions import CodewarsUnavailable
+from jobs import SyncJobQueue
+from metrics import InstrumentedBot, MetricsMiddleware
+from metrics import start_server as start_metrics_server
+from models import Chat
+from models import on_shutdown as db_shutdown
 from models import on_startup as db_startup
-from models.users import User
+from onboarding import import_users
+from repository import user_repository
 from services import ChatService, MentorService, UserService
+from webhook import make_app
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
 # Initialize bot and dispatcher
-bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
+bot = InstrumentedBot(token=API_TOKEN)
+if REDIS_HOST:
+    storage = RedisStorage2(REDIS_HOST, REDIS_PORT, db=REDIS_DB, password=REDIS_PASSWORD)
+else:
+    storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
+dp.middleware.setup(MetricsMiddleware(slow_threshold=SLOW_HANDLER_THRESHOLD))
 runner = Executor(dp)
+sync_jobs = SyncJobQueue(bot)
+
+
+CODEWARS_UNAVAILABLE = "Codewars is unavailable, try again later"
 
 
 # States
@@ -39,8 +61,7 @@ async def send_welcome(message: types.Message):
     """
     This handler will be called when user sends `/start` or `/help` command
     """
-    u = User(tg_id=message.from_user.id, tg_username=message.from_user.username)
-    await u.create()
+    await UserService.get_or_create(tg_id=message.from_user.id, tg_username=message.from_user.username)
     await message.reply("Hi!\nI'm the CodewarsBot!\nCreated by @dimashmello")
 
 
@@ -51,19 +72,60 @@ async def authorize_user(message: types.Message):
     await message.reply("Don't be shy. Type your Codewars username. I'll wait c:")
 
 
+async def get_cohort(message: types.Message) -> typing.Optional[int]:
+    """
+    The cohort of a group chat is the chat itself, in private chats it is
+    the one the user joined. Tells the user how to join when there is none.
+    """
+    if message.chat.type != 'private':
+        return message.chat.id
+    user = await user_repository.get(message.from_user.id)
+    if user is None or user.cohort_id is None:
+        await bot.send_message(message.chat.id, "Join your study group first: send /join in its chat")
+        return None
+    return user.cohort_id
+
+
+async def get_shuffle_cohort(message: types.Message) -> typing.Optional[int]:
+    """
+    Rounds are shuffled in the group chat itself, only the creator of the
+    bot may shuffle their cohort from a private chat
+    """
+    if message.chat.type == 'private' and str(message.from_user.id) != CREATOR_ID:
+        await bot.send_message(message.chat.id, "Shuffle in the group chat of your cohort")
+        return None
+    return await get_cohort(message)
+
+
+@dp.message_handler(commands=['join'])
+async def join_cohort(message: types.Message):
+    if message.chat.type == 'private':
+        return await message.reply("Send /join in the group chat you study with")
+    await ChatService.set_chat(message.chat)
+    await UserService.join_cohort(message.from_user, message.chat.id)
+    await message.reply(f"Welcome to {message.chat.title or 'the group'}!")
+
+
 @dp.message_handler(commands=['daily_stats'])
 async def send_daily_stats(message: types.Message):
-    msg = await UserService.get_daily_message()
+    cohort_id = await get_cohort(message)
+    if cohort_id is None:
+        return
+    msg = await UserService.get_daily_message(cohort_id)
     await bot.send_message(message.chat.id, text=msg, parse_mode=ParseMode.HTML)
 
 
 @dp.message_handler(commands=['update_solutions'])
 async def update_solutions(message: types.Message):
-    solved = await UserService.get_user_solved_katas(message.from_user)
-    if solved:
-        await bot.send_message(message.chat.id, text=f'Since last update you\'ve solved {solved} katas. Congrats!')
-    else:
-        await bot.send_message(message.chat.id, text="No katas were solved since last update. What are you waiting for?")
+    # `/update_solutions full` walks the whole history instead of new completions
+    full = message.get_args() == 'full'
+    user = await user_repository.get(message.from_user.id)
+    if user is None or not user.cw_username:
+        return await bot.send_message(message.chat.id, "Tell me your Codewars username first, use /authorize")
+    status = await bot.send_message(message.chat.id, "Updating your solutions, I'll let you know when it's done")
+    job = await sync_jobs.enqueue(user.tg_id, message.chat.id, status.message_id, full)
+    if job is None:
+        await status.edit_text("Your solutions are already being updated, hang on")
 
 
 @dp.message_handler(commands=['get_uncompleted'])
@@ -84,30 +146,61 @@ async def set_chat(message: types.Message):
         await bot.send_message(message.chat.id, text="Chat was set. You good to go!")
 
 
+async def send_pairs_table(chat_id: int, cohort_id: int):
+    for table in await MentorService.generate_table(cohort_id):
+        await bot.send_message(chat_id, table, parse_mode=ParseMode.HTML)
+
+
 @dp.message_handler(commands=['shuffle'])
 async def shuffle_users(message: types.Message):
-    await MentorService.distribute_users()
-    table = await MentorService.generate_table()
-    await bot.send_message(message.chat.id, table, parse_mode=ParseMode.HTML)
+    cohort_id = await get_shuffle_cohort(message)
+    if cohort_id is None:
+        return
+    await MentorService.distribute_users(cohort_id)
+    await send_pairs_table(message.chat.id, cohort_id)
 
 
 @dp.message_handler(commands=['reshuffle'])
 async def reshuffle_users(message: types.Message):
-    await MentorService.delete_previous_pairs()
-    await MentorService.distribute_users()
-    table = await MentorService.generate_table()
-    await bot.send_message(message.chat.id, table, parse_mode=ParseMode.HTML)
+    cohort_id = await get_shuffle_cohort(message)
+    if cohort_id is None:
+        return
+    await MentorService.delete_previous_pairs(cohort_id)
+    await MentorService.distribute_users(cohort_id)
+    await send_pairs_table(message.chat.id, cohort_id)
 
 
 @dp.message_handler(commands=['pairs'])
 async def send_pairs_info(message: types.Message):
-    table = await MentorService.generate_table()
-    await bot.send_message(message.chat.id, table, parse_mode=ParseMode.HTML)
+    cohort_id = await get_cohort(message)
+    if cohort_id is None:
+        return
+    await send_pairs_table(message.chat.id, cohort_id)
 
 
 @dp.message_handler(commands=['mentor'])
 async def make_user_mentor(message: types.Message):
-    await MentorService.make_me_mentor(message.from_user)
+    cohort_id = None
+    if message.chat.type != 'private':
+        # becoming a mentor in a group joins its cohort
+        cohort_id = (await ChatService.set_chat(message.chat)).id
+    await MentorService.make_me_mentor(message.from_user, cohort_id)
+
+
+@dp.message_handler(commands=['mentor_stats'])
+async def send_mentor_stats(message: types.Message):
+    cohort_id = await get_cohort(message)
+    if cohort_id is None:
+        return
+    # rates are confidential, mentors only see their own statistics
+    if str(message.from_user.id) == CREATOR_ID:
+        tables = await MentorService.generate_stats_table(cohort_id)
+    else:
+        tables = await MentorService.generate_stats_table(cohort_id, message.from_user.id)
+    if not tables:
+        return await bot.send_message(message.chat.id, "No rates yet")
+    for table in tables:
+        await bot.send_message(message.chat.id, table, parse_mode=ParseMode.HTML)
 
 
 @dp.message_handler(commands=['commands'])
@@ -146,89 +239,135 @@ async def process_name(message: types.Message, state: FSMContext):
         'tg_username': message.from_user.username,
         'cw_username': message.text
     }
+    if message.chat.type != 'private':
+        # authorizing in a group joins its cohort
+        await ChatService.set_chat(message.chat)
+        data['cohort_id'] = message.chat.id
+
+    try:
+        profile = await codewars.get_user(data['cw_username'], max_age=CODEWARS_PROFILE_TTL)
+        if profile is not None:
+            markup = types.ReplyKeyboardRemove()
+            await UserService.save_codewars_username(**data)
+            await bot.send_message(
+                message.chat.id,
+                md.text('Welcome on board,',
+                        md.bold(data['cw_username'])),
+                reply_markup=markup,
+                parse_mode=ParseMode.MARKDOWN,
+            )
 
-    async with aiohttp.ClientSession() as session:
-        async with session.head(f"{CODEWARS_BASE_URL}/{data['cw_username']}") as resp:
-            if resp.status in range(200, 300):
-                markup = types.ReplyKeyboardRemove()
-                obj, created = await UserService.get_or_create(tg_id=message.from_user.id)
-                await obj.update(**data).apply()
-                if created:
-                    await bot.send_message(
-                        message.chat.id,
-                        md.text('Welcome on board,',
-                                md.bold(data['cw_username'])),
-                        reply_markup=markup,
-                        parse_mode=ParseMode.MARKDOWN,
-                    )
-                else:
-                    await bot.send_message(
-                        message.chat.id,
-                        "Something went wrong"
-                    )
-
-            else:
-                await bot.send_message(
-                    message.chat.id,
-                    md.text("The user with username", md.bold(
-                        data['name']), "was not found"),
-                    parse_mode=ParseMode.MARKDOWN
-                )
-
-    # Finish conversation
-    await state.finish()
+        else:
+            await bot.send_message(
+                message.chat.id,
+                md.text("The user with username", md.bold(
+                    data['cw_username']), "was not found"),
+                parse_mode=ParseMode.MARKDOWN
+            )
+    except CodewarsUnavailable:
+        await bot.send_message(message.chat.id, CODEWARS_UNAVAILABLE)
+    finally:
+        # Finish conversation
+        await state.finish()
+
+
+@dp.message_handler(content_types=types.ContentType.DOCUMENT)
+async def import_cohort(message: types.Message):
+    """
+    Bulk onboarding: the creator sends a CSV or NDJSON file captioned /import
+    """
+    if not (message.caption or '').startswith('/import'):
+        return
+    if str(message.from_user.id) != CREATOR_ID:
+        return await message.reply("Only the creator of the bot can import users")
+    # the users join the group the file is sent to or the one given as `/import <chat id>`
+    if message.chat.type != 'private':
+        cohort_id = (await ChatService.set_chat(message.chat)).id
+    else:
+        _, _, arg = message.caption.partition(' ')
+        chat = await Chat.get(int(arg)) if arg.strip().lstrip('-').isdigit() else None
+        if chat is None:
+            return await message.reply("Send the file to the group chat or use /import <chat id> of a joined chat")
+        cohort_id = chat.id
+    document = await message.document.download(destination=io.BytesIO())
+    try:
+        text = document.getvalue().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return await message.reply("The file must be UTF-8 encoded CSV or NDJSON")
+    await message.reply("Checking the usernames, it may take a while")
+    result = await import_users(text, cohort_id)
+    report = [f'Imported {result.imported} users, {len(result.invalid)} rows skipped']
+    report += [f'Line {row.line}: {row.reason}' for row in result.invalid[:IMPORT_REPORT_ROWS]]
+    if len(result.invalid) > IMPORT_REPORT_ROWS:
+        report.append(f'... and {len(result.invalid) - IMPORT_REPORT_ROWS} more')
+    for part in split_text('\n'.join(report)):
+        await bot.send_message(message.chat.id, part)
 
 
 @dp.callback_query_handler(lambda msg: msg.data.startswith('user'))
 async def process_callback_on_user(callback_query: types.CallbackQuery):
     _, username = callback_query.data.split('_', maxsplit=1)
     await bot.answer_callback_query(callback_query.id)
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f'{CODEWARS_BASE_URL}/{username}/code-challenges/completed?page=0') as resp:
-            resp = await resp.json()
-
-            await bot.send_message(
-                callback_query.message.chat.id,
-                md.text(md.text("Total completed -"), md.bold(
-                    resp.get('totalItems'))),
-                parse_mode=ParseMode.MARKDOWN
-            )
+    try:
+        profile = await codewars.get_user(username, max_age=CODEWARS_PROFILE_TTL) or {}
+    except CodewarsUnavailable:
+        return await bot.send_message(callback_query.message.chat.id, CODEWARS_UNAVAILABLE)
+
+    await bot.send_message(
+        callback_query.message.chat.id,
+        md.text(md.text("Total completed -"), md.bold(
+            profile.get('codeChallenges', {}).get('totalCompleted'))),
+        parse_mode=ParseMode.MARKDOWN
+    )
 
 
 @dp.callback_query_handler(lambda msg: msg.data.startswith('next'))
-async def process_callback_on_user(callback_query: types.CallbackQuery):
-    _, offset = callback_query.data.split('_', maxsplit=1)
-    markup, count = await UserService.get_missing_katas(callback_query.message.from_user, int(offset))
+async def process_callback_on_next(callback_query: types.CallbackQuery):
+    _, cursor = callback_query.data.split('_', maxsplit=1)
+    markup, count = await UserService.get_missing_katas(callback_query.from_user, cursor)
 
     await callback_query.message.edit_reply_markup(reply_markup=markup)
 
 
 @dp.callback_query_handler(lambda msg: msg.data.startswith('rate'))
-async def process_callback_on_user(callback_query: types.CallbackQuery):
+async def process_callback_on_rate(callback_query: types.CallbackQuery):
     rate = int(callback_query.data.split('_', maxsplit=1).pop())
     mentee = await MentorService.get_mentee(callback_query.message.chat.id)
-    mentor = await MentorService.get_current_mentor(mentee)
+    mentor = await MentorService.get_current_mentor(mentee) if mentee and mentee.cohort_id else None
+    if mentor is None:
+        # left the cohort since the reminder was sent
+        await callback_query.message.edit_reply_markup(reply_markup=None)
+        return await callback_query.message.edit_text("You have no mentor to rate right now")
 
-    await MentorService.rate_mentor(mentee.tg_id, mentor.tg_id, rate)
+    await MentorService.rate_mentor(mentee.tg_id, mentor.tg_id, rate, mentee.cohort_id)
     await callback_query.message.edit_reply_markup(reply_markup=None)
     await callback_query.message.edit_text("Thanks for your feedback 💚")
 
 
 async def send_daily_updates():
-    chat = await ChatService.get_chat()
-    msg = await UserService.get_daily_message()
-    await dp.bot.send_message(chat.id, text=msg)
+    chats = await ChatService.get_chats()
+    messages = await asyncio.gather(*[UserService.get_daily_message(chat.id) for chat in chats])
+    result = await broadcast(dp.bot, [(chat.id, msg) for chat, msg in zip(chats, messages)])
+    logging.info('Daily updates: %d delivered, %d failed', result.delivered, result.failed)
+
+
+async def refresh_solutions():
+    summary = await UserService.extract_solved_katas_in_bulk()
+    logging.info(
+        'Refreshed solutions of %d users (%d failed): %d new solves in %.1fs',
+        summary.refreshed, summary.failed, summary.solved, summary.elapsed)
 
 
 async def send_daily_reminder_to_rate():
     markup = await MentorService.generate_rate_markup()
-    mentees = await MentorService.list_mentees()
-    for mentee in mentees:
-        text = await MentorService.get_reminder_message(mentee)
-        await dp.bot.send_message(mentee.tg_id, text, reply_markup=markup, parse_mode=ParseMode.HTML)
+    reminders = await MentorService.get_reminders()
+    result = await broadcast(dp.bot, reminders, reply_markup=markup, parse_mode=ParseMode.HTML)
+    logging.info('Rate reminders: %d delivered, %d failed', result.delivered, result.failed)
 
 
 async def scheduler():
+    # refresh solutions ahead of the daily leaderboard
+    aioschedule.every().day.at("10:00").do(refresh_solutions)
     aioschedule.every().day.at("11:00").do(send_daily_updates)
     aioschedule.every().monday.at("23:00").do(send_daily_reminder_to_rate)
 
@@ -238,24 +377,34 @@ async def scheduler():
 
 
 async def on_startup(dispatcher: Dispatcher):
-    # await dispatcher.bot.set_webhook(WEBHOOK_URL)
     await db_startup(dispatcher)
+    # the webhook app serves /metrics itself
+    if BOT_MODE != 'webhook' and METRICS_PORT:
+        await start_metrics_server(WEBAPP_HOST, METRICS_PORT)
+    await sync_jobs.start()
     asyncio.create_task(scheduler())
 
 
+async def on_shutdown(dispatcher: Dispatcher):
+    await sync_jobs.stop()
+    await codewars.close()
+    await dispatcher.storage.close()
+    await dispatcher.storage.wait_closed()
+    await close_redis()
+    await db_shutdown(dispatcher)
+
+
 if __name__ == '__main__':
-    executor.start_polling(
-        dp,
-        on_startup=on_startup,
-        on_shutdown=on_shutdown,
-        skip_updates=True
-    )
-    # executor.start_webhook(
-    #     dispatcher=dp,
-    #     webhook_path=WEBHOOK_PATH,
-    #     on_startup=on_startup,
-    #     on_shutdown=on_shutdown,
-    #     skip_updates=True,
-    #     host=WEBAPP_HOST,
-    #     port=WEBAPP_PORT,
-    # )
+    if BOT_MODE == 'webhook':
+        web.run_app(
+            make_app(dp, on_startup=on_startup, on_shutdown=on_shutdown),
+            host=WEBAPP_HOST,
+            port=WEBAPP_PORT,
+        )
+    else:
+        executor.start_polling(
+            dp,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+            skip_updates=True
+        )
@@ -0,0 +1,51 @@
+import asyncio
+import typing
+
+from aiogram import Bot
+from aiogram.utils.exceptions import NetworkError, RetryAfter, TelegramAPIError
+from loguru import logger
+
+from config import BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES, TELEGRAM_RATE_LIMIT
+from utils import RateLimiter
+
+
+class BroadcastResult(typing.NamedTuple):
+    delivered: int
+    failed: int
+
+
+async def broadcast(bot: Bot, messages: typing.Iterable[typing.Tuple[int, str]],
+                    **kwargs) -> BroadcastResult:
+    """
+    Send (chat_id, text) messages concurrently within Telegram's rate limit.
+
+    Flood control (RetryAfter) and network errors are retried, any other
+    failure is logged and skipped so that one blocked chat doesn't stop the
+    rest of the broadcast. Extra kwargs are passed to ``send_message``.
+    """
+    limiter = RateLimiter(TELEGRAM_RATE_LIMIT)
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def send(chat_id: int, text: str) -> bool:
+        async with semaphore:
+            for attempt in range(BROADCAST_MAX_RETRIES + 1):
+                await limiter.wait()
+                try:
+                    await bot.send_message(chat_id, text, **kwargs)
+                    return True
+                except RetryAfter as e:
+                    await asyncio.sleep(e.timeout)
+                except NetworkError:
+                    await asyncio.sleep(2 ** attempt)
+                except TelegramAPIError as e:
+                    logger.warning("Failed to send a message to {}: {}", chat_id, e)
+                    return False
+                except Exception:
+                    logger.exception("Failed to send a message to {}", chat_id)
+                    return False
+            logger.warning("Gave up sending a message to {}", chat_id)
+            return False
+
+    results = await asyncio.gather(*[send(chat_id, text) for chat_id, text in messages])
+    delivered = sum(results)
+    return BroadcastResult(delivered=delivered, failed=len(results) - delivered)
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import time
+import typing
+from collections import OrderedDict
+
+import aioredis
+
+from config import REDIS_DB, REDIS_HOST, REDIS_PASSWORD, REDIS_PORT
+
+
+class MemoryCache:
+    """
+    In-process key-value cache with per-entry expiry.
+
+    When ``maxsize`` is set the least recently used entries are evicted
+    once the cache grows past it.
+    """
+
+    def __init__(self, ttl: typing.Optional[float] = None, maxsize: typing.Optional[int] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    async def get(self, key: str, default=None):
+        try:
+            value, expires_at = self._data[key]
+        except KeyError:
+            return default
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value, ttl: typing.Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._data[key] = value, expires_at
+        self._data.move_to_end(key)
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def clear(self):
+        self._data.clear()
+
+
+_redis: typing.Optional[aioredis.Redis] = None
+_redis_lock: typing.Optional[asyncio.Lock] = None
+
+
+async def get_redis() -> aioredis.Redis:
+    """
+    Connection pool shared by every Redis-backed cache
+    """
+    global _redis, _redis_lock
+    if _redis_lock is None:
+        _redis_lock = asyncio.Lock()
+    async with _redis_lock:
+        if _redis is None or _redis.closed:
+            _redis = await aioredis.create_redis_pool(
+                (REDIS_HOST, REDIS_PORT), db=REDIS_DB, password=REDIS_PASSWORD)
+    return _redis
+
+
+async def close_redis():
+    global _redis, _redis_lock
+    if _redis is not None and not _redis.closed:
+        _redis.close()
+        await _redis.wait_closed()
+    # bound to the running loop as well
+    _redis, _redis_lock = None, None
+
+
+class RedisCache:
+    """
+    Cache kept in Redis and shared by every bot instance.
+
+    Values are stored as JSON. Eviction beyond the TTL is left to the
+    Redis ``maxmemory-policy``.
+    """
+
+    def __init__(self, namespace: str, ttl: typing.Optional[float] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def make_key(self, key: str) -> str:
+        return f'cache:{self.namespace}:{key}'
+
+    async def get(self, key: str, default=None):
+        redis = await get_redis()
+        value = await redis.get(self.make_key(key), encoding='utf8')
+        return default if value is None else json.loads(value)
+
+    async def set(self, key: str, value, ttl: typing.Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        redis = await get_redis()
+        await redis.set(self.make_key(key), json.dumps(value), pexpire=int(ttl * 1000) if ttl else 0)
+
+    async def delete(self, *keys: str):
+        if keys:
+            redis = await get_redis()
+            await redis.delete(*[self.make_key(key) for key in keys])
+
+    async def clear(self):
+        redis = await get_redis()
+        keys = [key async for key in redis.iscan(match=self.make_key('*'))]
+        if keys:
+            await redis.delete(*keys)
+
+
+def make_cache(namespace: str, ttl: typing.Optional[float] = None,
+               maxsize: typing.Optional[int] = None) -> typing.Union[MemoryCache, RedisCache]:
+    """
+    Redis-backed cache when Redis is configured, in-process one otherwise.
+
+    ``maxsize`` only bounds the in-process cache, Redis entries are bounded
+    by their TTL and by the server's maxmemory policy.
+    """
+    if REDIS_HOST:
+        return RedisCache(namespace, ttl=ttl)
+    return MemoryCache(ttl=ttl, maxsize=maxsize)
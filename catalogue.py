@@ -0,0 +1,217 @@
+"""
+Kata catalogue indexer.
+
+Bulk-loads kata metadata (id, name, slug) into the ``katas`` table either
+from Codewars or from a JSON/NDJSON dump for offline runs::
+
+    python catalogue.py --dump katas.ndjson
+    python catalogue.py --ids katas.txt --checkpoint katas.pos
+
+Every kata is stored with a checksum of its metadata so unchanged entries
+are skipped, and the checkpoint file remembers how many entries were
+committed so an interrupted run can pick up where it stopped.
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import typing
+
+from loguru import logger
+
+from cache import close_redis
+from codewars import codewars
+from config import CATALOGUE_BATCH_SIZE
+from models import acquire, on_shutdown, on_startup
+from services import leaderboard_cache, unsolved_cache
+
+
+def checksum(kata: dict) -> str:
+    payload = json.dumps([kata.get('id'), kata.get('name'), kata.get('slug')])
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def read_dump(path: str) -> typing.Iterator[dict]:
+    """
+    Katas from a JSON array or a newline-delimited JSON file
+    """
+    with open(path) as f:
+        head = f.read(1)
+        while head.isspace():
+            head = f.read(1)
+        f.seek(0)
+        if head == '[':
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_refs(path: str) -> typing.Iterator[str]:
+    """
+    Kata ids or slugs, one per line
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield line.strip()
+
+
+async def fetch_katas(refs: typing.Iterable[str], batch_size: int) -> typing.AsyncIterator[typing.List[dict]]:
+    """
+    Kata metadata from Codewars, fetched concurrently batch by batch
+    """
+    refs = iter(refs)
+    while True:
+        batch = list(itertools.islice(refs, batch_size))
+        if not batch:
+            return
+        katas = await asyncio.gather(*[codewars.get_challenge(ref) for ref in batch])
+        for ref, kata in zip(batch, katas):
+            if kata is None:
+                logger.warning("Kata {} was not found on Codewars", ref)
+        # keep the batch length so the checkpoint counts processed refs
+        yield katas
+
+
+async def read_batches(katas: typing.Iterable[dict], batch_size: int) -> typing.AsyncIterator[typing.List[dict]]:
+    katas = iter(katas)
+    while True:
+        batch = list(itertools.islice(katas, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def unique_katas(katas: typing.Iterable[typing.Optional[dict]]) -> typing.List[dict]:
+    """
+    Katas with an id, the last entry of a repeated id wins. A statement
+    can't upsert the same row twice, and a dump may repeat an entry or a
+    list of refs name a kata by both its id and its slug.
+    """
+    return list({kata.get('id'): kata for kata in katas if kata is not None and kata.get('id')}.values())
+
+
+async def upsert_katas(katas: typing.List[dict]) -> typing.Tuple[int, int]:
+    """
+    Insert new katas and update changed ones in one statement.
+    Returns the number of stored rows and of newly inserted ones.
+    """
+    katas = unique_katas(katas)
+    if not katas:
+        return 0, 0
+    async with acquire() as conn:
+        stored, inserted = await conn.raw_connection.fetchrow("""
+            WITH stored AS (
+                INSERT INTO katas (id, name, slug, checksum)
+                SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::varchar[], $4::varchar[])
+                ON CONFLICT (id) DO UPDATE
+                SET name = EXCLUDED.name, slug = EXCLUDED.slug, checksum = EXCLUDED.checksum
+                WHERE katas.checksum IS DISTINCT FROM EXCLUDED.checksum
+                -- xmax is only set on rows updated by the conflict clause
+                RETURNING xmax = 0 AS inserted
+            )
+            SELECT COUNT(*), COUNT(*) FILTER (WHERE inserted) FROM stored;
+        """,
+            [kata.get('id') for kata in katas],
+            [kata.get('name') for kata in katas],
+            [kata.get('slug') for kata in katas],
+            [checksum(kata) for kata in katas],
+        )
+    return stored, inserted
+
+
+async def credit_pending_solves() -> int:
+    """
+    Store the pending completions of katas now in the catalogue as solved.
+    Returns the number of newly stored solutions.
+    """
+    async with acquire() as conn:
+        return await conn.raw_connection.fetchval("""
+            WITH credited AS (
+                DELETE FROM pending_solved_katas AS pending
+                USING katas
+                WHERE katas.id = pending.kata_id
+                RETURNING pending.user_id, pending.kata_id
+            ),
+            inserted AS (
+                INSERT INTO solved_katas (kata_id, user_id)
+                SELECT kata_id, user_id FROM credited
+                ON CONFLICT (user_id, kata_id) DO NOTHING
+                RETURNING 1
+            )
+            SELECT COUNT(*) FROM inserted;
+        """)
+
+
+def read_checkpoint(path: typing.Optional[str]) -> int:
+    if path is None or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return int(f.read().strip() or 0)
+
+
+def write_checkpoint(path: typing.Optional[str], position: int):
+    if path is None:
+        return
+    with open(path, 'w') as f:
+        f.write(str(position))
+
+
+async def index_katas(batches: typing.AsyncIterator[typing.List[dict]],
+                      checkpoint: typing.Optional[str] = None) -> typing.Tuple[int, int]:
+    """
+    Upsert batches of katas, committing the checkpoint after each one.
+    Returns the number of processed entries and of stored rows.
+    """
+    position = read_checkpoint(checkpoint)
+    processed, stored, credited = 0, 0, 0
+    async for batch in batches:
+        batch_stored, inserted = await upsert_katas(batch)
+        if inserted:
+            credited += await credit_pending_solves()
+        stored += batch_stored
+        processed += len(batch)
+        write_checkpoint(checkpoint, position + processed)
+        logger.info("Indexed {} katas, {} new or changed", processed, stored)
+    # completions a sync kept pending while a batch was being stored
+    credited += await credit_pending_solves()
+    if credited:
+        logger.info("Credited {} solutions of newly indexed katas", credited)
+    if stored or credited:
+        # the catalogue feeds both the leaderboard and the unsolved lists
+        await leaderboard_cache.clear()
+        await unsolved_cache.clear()
+    return processed, stored
+
+
+async def main(args: argparse.Namespace):
+    skip = read_checkpoint(args.checkpoint)
+    if args.dump:
+        entries = itertools.islice(read_dump(args.dump), skip, None)
+        batches = read_batches(entries, args.batch_size)
+    else:
+        refs = itertools.islice(read_refs(args.ids), skip, None)
+        batches = fetch_katas(refs, args.batch_size)
+
+    await on_startup(None)
+    try:
+        processed, stored = await index_katas(batches, args.checkpoint)
+    finally:
+        await codewars.close()
+        await close_redis()
+        await on_shutdown(None)
+    logger.info("Done: {} katas processed, {} new or changed", processed, stored)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--dump', help='JSON or NDJSON file with kata metadata')
+    source.add_argument('--ids', help='file with Codewars kata ids or slugs, one per line')
+    parser.add_argument('--checkpoint', help='file keeping the position of the last committed batch')
+    parser.add_argument('--batch-size', type=int, default=CATALOGUE_BATCH_SIZE)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,206 @@
+import asyncio
+import time
+import typing
+from datetime import datetime
+
+import aiohttp
+from dateutil.parser import isoparse
+
+from cache import make_cache
+from config import (CODEWARS_BASE_URL, CODEWARS_CACHE_SIZE, CODEWARS_CACHE_TTL, CODEWARS_CHALLENGES_URL,
+                    CODEWARS_CONCURRENCY, CODEWARS_DNS_TTL, CODEWARS_MAX_RETRIES, CODEWARS_RATE_LIMIT,
+                    CODEWARS_RETRY_BACKOFF, CODEWARS_TIMEOUT)
+from exceptions import CodewarsUnavailable
+from metrics import observe_http_request
+from utils import RateLimiter
+
+# awaited with the number of fetched pages and the total number of pages,
+# None when only part of the pages is going to be fetched
+Progress = typing.Optional[typing.Callable[[int, typing.Optional[int]], typing.Awaitable]]
+
+
+class CodewarsClient:
+    """
+    Thin wrapper around the Codewars API.
+
+    Owns one keep-alive session with cached DNS lookups and keeps successful
+    profile and kata responses in a cache, so they can be served locally
+    while fresh and revalidated with ETag/Last-Modified afterwards.
+    """
+
+    def __init__(self, base_url: str = CODEWARS_BASE_URL, concurrency: int = CODEWARS_CONCURRENCY,
+                 rate_limit: float = CODEWARS_RATE_LIMIT, max_retries: int = CODEWARS_MAX_RETRIES,
+                 retry_backoff: float = CODEWARS_RETRY_BACKOFF,
+                 challenges_url: str = CODEWARS_CHALLENGES_URL):
+        self.base_url = base_url
+        self.challenges_url = challenges_url
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate_limit)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.cache = make_cache('codewars', ttl=CODEWARS_CACHE_TTL, maxsize=CODEWARS_CACHE_SIZE)
+        self._session: typing.Optional[aiohttp.ClientSession] = None
+        self._semaphore: typing.Optional[asyncio.Semaphore] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.concurrency * 2,
+                ttl_dns_cache=CODEWARS_DNS_TTL,
+                resolver=aiohttp.AsyncResolver(),
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=CODEWARS_TIMEOUT),
+            )
+        return self._session
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def get_json(self, url: str, max_age: float = 0, cached: bool = True) -> dict:
+        """
+        GET a JSON document.
+
+        A cached response younger than ``max_age`` seconds is returned without
+        a request, an older one is revalidated with a conditional request.
+        Responses of documents fetched with ``cached`` unset are never kept.
+        429, 5xx and connection errors are retried with exponential backoff.
+        """
+        entry = await self.cache.get(url) if cached else None
+        if entry is not None and time.time() - entry['fetched_at'] < max_age:
+            return entry['body']
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        for attempt in range(self.max_retries + 1):
+            delay = self.retry_backoff * 2 ** attempt
+            await self.limiter.wait()
+            try:
+                async with self.semaphore:
+                    started = time.monotonic()
+                    async with self.session.get(url, headers=headers) as resp:
+                        observe_http_request('codewars', time.monotonic() - started)
+                        if resp.status == 304:
+                            if entry is not None:
+                                entry['fetched_at'] = time.time()
+                                await self.cache.set(url, entry)
+                                return entry['body']
+                            # nothing to serve the empty body from, ask for the document
+                            headers, reason = {}, 'HTTP 304 without a cached response'
+                            continue
+                        if resp.status != 429 and resp.status < 500:
+                            body = await resp.json()
+                            if resp.status < 300 and cached:
+                                await self.store(url, resp, body, max_age)
+                            return body
+                        reason = f'HTTP {resp.status}'
+                        retry_after = resp.headers.get('Retry-After', '')
+                        if retry_after.isdigit():
+                            delay = max(delay, int(retry_after))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                reason = repr(e)
+            if attempt < self.max_retries:
+                await asyncio.sleep(delay)
+        raise CodewarsUnavailable(f'{url}: {reason}')
+
+    async def store(self, url: str, resp: aiohttp.ClientResponse, body: dict, max_age: float):
+        etag, last_modified = resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+        # nothing to serve or revalidate later
+        if not (etag or last_modified or max_age):
+            return
+        await self.cache.set(url, {
+            'body': body,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': time.time(),
+        })
+
+    async def get_user(self, username: str, max_age: float = 0) -> typing.Optional[dict]:
+        """
+        Codewars profile, or None when there is no such user
+        """
+        resp = await self.get_json(f'{self.base_url}/{username}', max_age)
+        return resp if resp.get('username') else None
+
+    async def get_completed_page(self, username: str, page: int = 0) -> dict:
+        # pages are rarely read twice, keeping them would only grow the cache
+        return await self.get_json(f'{self.base_url}/{username}/code-challenges/completed?page={page}',
+                                   cached=False)
+
+    async def get_completed_pages(self, username: str, progress: Progress = None) -> typing.List[dict]:
+        """
+        Fetch every page of completed challenges.
+
+        Page 0 is fetched first to learn the number of pages, the rest are
+        fetched concurrently, bounded by the client's semaphore. ``progress``
+        is awaited with the number of fetched and total pages after every page.
+        """
+        first = await self.get_completed_page(username, 0)
+        total_pages = first.get('totalPages') or 0
+        done = 1
+
+        async def fetch(page: int) -> dict:
+            nonlocal done
+            resp = await self.get_completed_page(username, page)
+            done += 1
+            if progress is not None:
+                await progress(done, total_pages)
+            return resp
+
+        if progress is not None:
+            await progress(done, total_pages)
+        rest = await asyncio.gather(*[fetch(page) for page in range(1, total_pages)])
+        return [first, *rest]
+
+    async def get_completed_since(self, username: str, completed_at: datetime,
+                                  kata_id: str, progress: Progress = None) -> typing.List[dict]:
+        """
+        Fetch completions newer than the given one.
+
+        Codewars lists completions newest first, so pages are walked in order
+        and paging stops at the first already known completion. ``progress``
+        is awaited with the number of fetched pages only, as the number of
+        pages left to fetch isn't known.
+        """
+        katas = []
+        page, total_pages = 0, 1
+        while page < total_pages:
+            resp = await self.get_completed_page(username, page)
+            total_pages = resp.get('totalPages') or 0
+            if progress is not None:
+                await progress(page + 1, None)
+            for kata in resp.get('data') or []:
+                kata_completed_at = completed_at_of(kata)
+                if kata_completed_at < completed_at or (
+                        kata_completed_at == completed_at and kata.get('id') == kata_id):
+                    return katas
+                katas.append(kata)
+            page += 1
+        return katas
+
+    async def get_challenge(self, id_or_slug: str) -> typing.Optional[dict]:
+        """
+        Kata metadata, or None when Codewars doesn't know the kata
+        """
+        resp = await self.get_json(f'{self.challenges_url}/{id_or_slug}')
+        return resp if resp.get('id') else None
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+def completed_at_of(kata: dict) -> datetime:
+    return isoparse(kata.get('completedAt'))
+
+
+codewars = CodewarsClient()
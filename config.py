@@ -3,10 +3,42 @@ from envparse import env
 env.read_envfile()
 
 API_TOKEN = env.str('BOT_TOKEN')
-CODEWARS_BASE_URL = 'https://www.codewars.com/api/v1/users'
+CODEWARS_BASE_URL = env.str('CODEWARS_BASE_URL', default='https://www.codewars.com/api/v1/users')
 POSTGRES_URI = env.str('DATABASE_URI')
 WEBHOOK_URL = env.str('WEBHOOK_URL')
 CODEWARS_BASE_KATA_URL = 'https://www.codewars.com/kata'
+CODEWARS_CHALLENGES_URL = env.str('CODEWARS_CHALLENGES_URL',
+                                  default='https://www.codewars.com/api/v1/code-challenges')
+# number of Codewars requests allowed to be in flight at once
+CODEWARS_CONCURRENCY = env.int('CODEWARS_CONCURRENCY', default=5)
+# global budget of Codewars requests per second, 0 disables the limit
+CODEWARS_RATE_LIMIT = env.float('CODEWARS_RATE_LIMIT', default=5.0)
+# retries on 429/5xx responses and connection errors
+CODEWARS_MAX_RETRIES = env.int('CODEWARS_MAX_RETRIES', default=3)
+CODEWARS_RETRY_BACKOFF = env.float('CODEWARS_RETRY_BACKOFF', default=1.0)
+CODEWARS_TIMEOUT = env.float('CODEWARS_TIMEOUT', default=30.0)
+CODEWARS_DNS_TTL = env.int('CODEWARS_DNS_TTL', default=300)
+# responses kept for revalidation and how long they are kept
+CODEWARS_CACHE_SIZE = env.int('CODEWARS_CACHE_SIZE', default=2048)
+CODEWARS_CACHE_TTL = env.int('CODEWARS_CACHE_TTL', default=86400)
+# seconds a profile lookup is served from the cache without a request
+CODEWARS_PROFILE_TTL = env.int('CODEWARS_PROFILE_TTL', default=300)
+
+# number of users refreshed concurrently by the bulk sync job
+SYNC_WORKERS = env.int('SYNC_WORKERS', default=4)
+# /update_solutions jobs run at once by every bot process
+SYNC_JOB_WORKERS = env.int('SYNC_JOB_WORKERS', default=4)
+# seconds an idle worker waits before looking for jobs queued by other processes
+SYNC_JOB_POLL_INTERVAL = env.float('SYNC_JOB_POLL_INTERVAL', default=5.0)
+# running jobs silent for this many seconds are considered lost and queued again
+SYNC_JOB_STALE_AFTER = env.int('SYNC_JOB_STALE_AFTER', default=600)
+SYNC_JOB_MAX_ATTEMPTS = env.int('SYNC_JOB_MAX_ATTEMPTS', default=3)
+# seconds between two looks for lost jobs by an idle worker
+SYNC_JOB_MAINTENANCE_INTERVAL = env.float('SYNC_JOB_MAINTENANCE_INTERVAL', default=60.0)
+# finished jobs are deleted this many seconds after they finished
+SYNC_JOB_RETENTION = env.int('SYNC_JOB_RETENTION', default=7 * 86400)
+# minimum seconds between two edits of a job's status message
+SYNC_PROGRESS_INTERVAL = env.float('SYNC_PROGRESS_INTERVAL', default=2.0)
 
 # webhook settings
 WEBHOOK_HOST = env.str('WEBHOOK_HOST')
@@ -14,10 +46,62 @@ WEBHOOK_PATH = '/'
 WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
 
 # webserver settings
-WEBAPP_HOST = 'localhost'  # or ip
-WEBAPP_PORT = 3000
+WEBAPP_HOST = env.str('WEBAPP_HOST', default='localhost')  # or ip
+WEBAPP_PORT = env.int('WEBAPP_PORT', default=3000)
+
+# `polling` or `webhook`
+BOT_MODE = env.str('BOT_MODE', default='polling')
+# update handlers running at once in webhook mode
+WEBHOOK_CONCURRENCY = env.int('WEBHOOK_CONCURRENCY', default=32)
+# accepted but unfinished updates before Telegram is asked to retry later
+WEBHOOK_MAX_PENDING = env.int('WEBHOOK_MAX_PENDING', default=1000)
+# seconds to wait for in-flight updates on shutdown
+WEBHOOK_DRAIN_TIMEOUT = env.float('WEBHOOK_DRAIN_TIMEOUT', default=30.0)
+
+# redis settings, FSM state and caches stay in process memory when no host is set
+REDIS_HOST = env.str('REDIS_HOST', default='')
+REDIS_PORT = env.int('REDIS_PORT', default=6379)
+REDIS_DB = env.int('REDIS_DB', default=0)
+REDIS_PASSWORD = env.str('REDIS_PASSWORD', default='') or None
+
+# seconds a replica holds the lock of a coalesced call and waits for another replica's
+SINGLEFLIGHT_LOCK_TTL = env.float('SINGLEFLIGHT_LOCK_TTL', default=300.0)
+SINGLEFLIGHT_POLL_INTERVAL = env.float('SINGLEFLIGHT_POLL_INTERVAL', default=0.2)
+
+# port serving /metrics in polling mode, 0 disables it; webhook mode serves it on WEBAPP_PORT
+METRICS_PORT = env.int('METRICS_PORT', default=0)
+# handlers slower than this many seconds are logged
+SLOW_HANDLER_THRESHOLD = env.float('SLOW_HANDLER_THRESHOLD', default=1.0)
+
+# broadcast settings, Telegram allows about 30 messages per second
+TELEGRAM_RATE_LIMIT = env.float('TELEGRAM_RATE_LIMIT', default=25.0)
+BROADCAST_CONCURRENCY = env.int('BROADCAST_CONCURRENCY', default=10)
+BROADCAST_MAX_RETRIES = env.int('BROADCAST_MAX_RETRIES', default=3)
+
+# seconds a cached leaderboard is served before it is rebuilt
+LEADERBOARD_TTL = env.int('LEADERBOARD_TTL', default=600)
+# users whose unsolved katas are kept in memory for pagination, with Redis
+# configured the lists only expire after UNSOLVED_CACHE_TTL and anything
+# beyond that is evicted by the server's maxmemory policy
+UNSOLVED_CACHE_SIZE = env.int('UNSOLVED_CACHE_SIZE', default=256)
+UNSOLVED_CACHE_TTL = env.int('UNSOLVED_CACHE_TTL', default=3600)
+# seconds the current pairing round id is cached, shuffles drop it right away
+ROUND_CACHE_TTL = env.int('ROUND_CACHE_TTL', default=3600)
+# rendered /pairs tables kept, one per round
+PAIRS_TABLE_CACHE_SIZE = env.int('PAIRS_TABLE_CACHE_SIZE', default=8)
+# users kept in the per-process identity map and for how many seconds
+USER_CACHE_SIZE = env.int('USER_CACHE_SIZE', default=1024)
+USER_CACHE_TTL = env.int('USER_CACHE_TTL', default=60)
+# katas upserted per statement by the catalogue indexer
+CATALOGUE_BATCH_SIZE = env.int('CATALOGUE_BATCH_SIZE', default=500)
 
 MIN_RATE = 1
 MAX_RATE = 5
+# latest rates of a mentor kept for the recent average
+MENTOR_STATS_WINDOW = env.int('MENTOR_STATS_WINDOW', default=10)
+# weight of the neutral prior in a mentor's smoothed rating, in rates
+MENTOR_RATING_PRIOR = env.int('MENTOR_RATING_PRIOR', default=3)
 
-CREATOR_ID = env.str("CREATOR_ID")
\ No newline at end of file
+CREATOR_ID = env.str("CREATOR_ID")
+# skipped rows listed in the report of a bulk import
+IMPORT_REPORT_ROWS = env.int('IMPORT_REPORT_ROWS', default=50)
\ No newline at end of file
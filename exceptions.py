@@ -1,2 +1,6 @@
 class PairAlreadyExists(BaseException):
     pass
+
+
+class CodewarsUnavailable(Exception):
+    pass
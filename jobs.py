@@ -0,0 +1,213 @@
+"""
+Background solutions sync.
+
+``/update_solutions`` stores a ``SyncJob`` and returns right away. Workers
+of every bot process claim queued jobs with ``FOR UPDATE SKIP LOCKED``, so
+a job runs exactly once however many replicas poll the table, and report
+progress by editing the job's status message.
+"""
+import asyncio
+import time
+import typing
+
+from aiogram import Bot
+from aiogram.utils.exceptions import TelegramAPIError
+from loguru import logger
+from sqlalchemy.dialects.postgresql import insert
+
+from config import (SYNC_JOB_MAINTENANCE_INTERVAL, SYNC_JOB_MAX_ATTEMPTS, SYNC_JOB_POLL_INTERVAL,
+                    SYNC_JOB_RETENTION, SYNC_JOB_STALE_AFTER, SYNC_JOB_WORKERS, SYNC_PROGRESS_INTERVAL)
+from models import SyncJob, db
+from repository import user_repository
+from services import UserService
+
+
+def result_text(solved: int) -> str:
+    if solved:
+        return f'Since last update you\'ve solved {solved} katas. Congrats!'
+    return "No katas were solved since last update. What are you waiting for?"
+
+
+class SyncJobQueue:
+    """
+    Postgres-backed queue of solutions syncs run by ``workers`` tasks
+    """
+
+    def __init__(self, bot: Bot, workers: int = SYNC_JOB_WORKERS,
+                 poll_interval: float = SYNC_JOB_POLL_INTERVAL):
+        self.bot = bot
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._tasks: typing.List[asyncio.Task] = []
+        self._wakeup: typing.Optional[asyncio.Event] = None
+        self._maintained_at = float('-inf')
+
+    @property
+    def wakeup(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    async def enqueue(self, user_id: int, chat_id: int, message_id: int = None,
+                      full: bool = False) -> typing.Optional[SyncJob]:
+        """
+        Queue a sync of the user, returns None when one is already queued or running
+        """
+        query = insert(SyncJob.__table__).values(
+            user_id=user_id, chat_id=chat_id, message_id=message_id, full=full,
+        ).on_conflict_do_nothing(
+            index_elements=[SyncJob.user_id],
+            index_where=db.text(SyncJob.ACTIVE),
+        ).returning(*SyncJob)
+        job = await db.first(query.execution_options(loader=SyncJob))
+        if job is not None:
+            self.wakeup.set()
+        return job
+
+    @staticmethod
+    async def claim() -> typing.Optional[SyncJob]:
+        """
+        Mark the oldest queued job as running and return it
+        """
+        oldest = db.select([SyncJob.id]).where(
+            SyncJob.status == SyncJob.QUEUED,
+        ).order_by(SyncJob.id).limit(1).with_for_update(skip_locked=True).as_scalar()
+        return await SyncJob.update.values(
+            status=SyncJob.RUNNING,
+            attempts=SyncJob.attempts + 1,
+            updated_at=db.func.now(),
+        ).where(SyncJob.id == oldest).returning(*SyncJob).gino.load(SyncJob).first()
+
+    @staticmethod
+    async def requeue_stale(stale_after: int = SYNC_JOB_STALE_AFTER,
+                            max_attempts: int = SYNC_JOB_MAX_ATTEMPTS):
+        """
+        Queue again the running jobs whose process is gone, giving up on the
+        ones that were already tried ``max_attempts`` times
+        """
+        stale = db.and_(
+            SyncJob.status == SyncJob.RUNNING,
+            SyncJob.updated_at < db.func.now() - db.text(f"interval '{int(stale_after)} seconds'"),
+        )
+        await SyncJob.update.values(
+            status=SyncJob.FAILED, error='too many attempts', updated_at=db.func.now(),
+        ).where(db.and_(stale, SyncJob.attempts >= max_attempts)).gino.status()
+        await SyncJob.update.values(
+            status=SyncJob.QUEUED, updated_at=db.func.now(),
+        ).where(stale).gino.status()
+
+    @staticmethod
+    async def prune(retention: int = SYNC_JOB_RETENTION):
+        """
+        Delete the jobs finished more than ``retention`` seconds ago
+        """
+        await SyncJob.delete.where(db.and_(
+            SyncJob.status.in_([SyncJob.DONE, SyncJob.FAILED]),
+            SyncJob.updated_at < db.func.now() - db.text(f"interval '{int(retention)} seconds'"),
+        )).gino.status()
+
+    async def maintain(self):
+        """
+        Requeue lost jobs and prune finished ones, at most once per
+        ``SYNC_JOB_MAINTENANCE_INTERVAL`` seconds. Jobs of a process that
+        died or restarted within ``SYNC_JOB_STALE_AFTER`` are picked up once
+        they turn stale, by whichever process is idle then.
+        """
+        now = time.monotonic()
+        if now - self._maintained_at < SYNC_JOB_MAINTENANCE_INTERVAL:
+            return
+        self._maintained_at = now
+        try:
+            await self.requeue_stale()
+            await self.prune()
+        except Exception:
+            logger.exception("Failed to maintain the sync job queue")
+
+    async def start(self):
+        await self.maintain()
+        self._tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def work(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                job = await self.claim()
+            except Exception:
+                logger.exception("Failed to claim a sync job")
+                job = None
+            if job is None:
+                await self.maintain()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.run(job)
+            except Exception:
+                logger.exception("Failed to run sync job {}", job.id)
+
+    async def run(self, job: SyncJob):
+        # the sync cursor may have been changed by another process
+        await user_repository.invalidate(job.user_id)
+        user = await user_repository.get(job.user_id)
+        if user is None or not user.cw_username:
+            await job.update(status=SyncJob.FAILED, error='no Codewars username', updated_at=db.func.now()).apply()
+            return
+        try:
+            solved = await UserService.extract_solved_katas(user, job.full, self.progress(job))
+        except asyncio.CancelledError:
+            # shutting down, another process or the next start picks it up
+            await job.update(status=SyncJob.QUEUED, attempts=SyncJob.attempts - 1,
+                             updated_at=db.func.now()).apply()
+            raise
+        except Exception as e:
+            logger.exception("Sync job {} of {} failed", job.id, user.cw_username)
+            await job.update(status=SyncJob.FAILED, error=repr(e), updated_at=db.func.now()).apply()
+            await self.finish(job, "Couldn't update your solutions, try again later")
+            return
+        await job.update(status=SyncJob.DONE, solved=solved, updated_at=db.func.now()).apply()
+        await self.finish(job, result_text(solved))
+
+    def progress(self, job: SyncJob) -> typing.Callable[[int, typing.Optional[int]], typing.Awaitable]:
+        """
+        Progress callback editing the status message of the job, at most
+        once per ``SYNC_PROGRESS_INTERVAL`` seconds
+        """
+        last = 0.0
+
+        async def report(done: int, total: typing.Optional[int]):
+            nonlocal last
+            now = time.monotonic()
+            if now - last < SYNC_PROGRESS_INTERVAL and (total is None or done < total):
+                return
+            last = now
+            # also tells the other processes the job is alive
+            await SyncJob.update.values(updated_at=db.func.now()).where(SyncJob.id == job.id).gino.status()
+            if job.message_id is not None:
+                # incremental syncs stop at the first known completion, long before the last page
+                pages = f'page {done} of {total}' if total is not None else f'{done} pages fetched'
+                try:
+                    await self.bot.edit_message_text(
+                        f'Updating your solutions: {pages}', job.chat_id, job.message_id)
+                except TelegramAPIError as e:
+                    logger.debug("Failed to report progress of sync job {}: {}", job.id, e)
+
+        return report
+
+    async def finish(self, job: SyncJob, text: str):
+        if job.message_id is not None:
+            try:
+                await self.bot.delete_message(job.chat_id, job.message_id)
+            except TelegramAPIError as e:
+                logger.debug("Failed to delete the status message of sync job {}: {}", job.id, e)
+        try:
+            await self.bot.send_message(job.chat_id, text)
+        except TelegramAPIError as e:
+            logger.warning("Failed to post the result of sync job {}: {}", job.id, e)
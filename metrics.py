@@ -0,0 +1,250 @@
+"""
+Latency and round-trip instrumentation exposed in the Prometheus text format.
+
+``MetricsMiddleware`` times every message and callback handler and collects
+the DB queries and outbound HTTP calls made while handling the update, the
+database side being counted by ``InstrumentedConnection``.
+"""
+import contextvars
+import time
+import typing
+from collections import defaultdict
+
+import asyncpg
+from aiogram import Bot, types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import web
+from loguru import logger
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# handler label of updates no handler took
+UNHANDLED = 'unhandled'
+
+LabelValues = typing.Tuple[str, ...]
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: typing.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        registry.append(self)
+
+    def label_values(self, labels: dict) -> LabelValues:
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def format_labels(self, values: LabelValues, **extra) -> str:
+        pairs = [*zip(self.labels, values), *extra.items()]
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+    def samples(self) -> typing.Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return '\n'.join([
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+            *self.samples(),
+        ])
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self._values[self.label_values(labels)] += amount
+
+    def samples(self) -> typing.Iterator[str]:
+        for values, value in self._values.items():
+            yield f'{self.name}{self.format_labels(values)} {value}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: typing.Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self._counts = defaultdict(lambda: [0] * len(self.buckets))
+        self._sums = defaultdict(float)
+        self._totals = defaultdict(int)
+
+    def observe(self, value: float, **labels):
+        values = self.label_values(labels)
+        counts = self._counts[values]
+        for num, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[num] += 1
+        self._sums[values] += value
+        self._totals[values] += 1
+
+    def samples(self) -> typing.Iterator[str]:
+        for values, counts in self._counts.items():
+            for bound, count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket{self.format_labels(values, le=bound)} {count}'
+            yield f'{self.name}_bucket{self.format_labels(values, le="+Inf")} {self._totals[values]}'
+            yield f'{self.name}_sum{self.format_labels(values)} {self._sums[values]}'
+            yield f'{self.name}_count{self.format_labels(values)} {self._totals[values]}'
+
+
+registry: typing.List[Metric] = []
+
+handler_seconds = Histogram('bot_handler_seconds', 'Time spent handling an update', ['handler'])
+handler_db_queries = Histogram('bot_handler_db_queries', 'DB round trips made while handling an update',
+                               ['handler'], buckets=COUNT_BUCKETS)
+handler_http_requests = Histogram('bot_handler_http_requests', 'Outbound HTTP requests made while handling an update',
+                                  ['handler'], buckets=COUNT_BUCKETS)
+db_query_seconds = Histogram('bot_db_query_seconds', 'DB round trip time')
+http_request_seconds = Histogram('bot_http_request_seconds', 'Outbound HTTP request time', ['service'])
+slow_handlers = Counter('bot_slow_handlers_total', 'Updates handled slower than the threshold', ['handler'])
+
+
+class UpdateStats:
+    """
+    Round trips made while handling the current update
+    """
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.started = time.monotonic()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.http_requests = 0
+        self.http_seconds = 0.0
+
+
+current_stats = contextvars.ContextVar('current_stats', default=None)
+
+
+def observe_db_query(elapsed: float):
+    db_query_seconds.observe(elapsed)
+    stats = current_stats.get()
+    if stats is not None:
+        stats.db_queries += 1
+        stats.db_seconds += elapsed
+
+
+def observe_http_request(service: str, elapsed: float):
+    http_request_seconds.observe(elapsed, service=service)
+    stats = current_stats.get()
+    if stats is not None:
+        stats.http_requests += 1
+        stats.http_seconds += elapsed
+
+
+class InstrumentedConnection(asyncpg.Connection):
+    """
+    asyncpg connection timing every round trip, both Gino's prepared
+    statements and raw queries go through ``_do_execute``
+    """
+
+    async def _do_execute(self, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return await super()._do_execute(*args, **kwargs)
+        finally:
+            observe_db_query(time.monotonic() - started)
+
+
+class InstrumentedBot(Bot):
+    """
+    Bot timing every Telegram API call
+    """
+
+    async def request(self, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return await super().request(*args, **kwargs)
+        finally:
+            observe_http_request('telegram', time.monotonic() - started)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Records latency and round trips of every message and callback handler
+    and logs the ones slower than ``slow_threshold`` seconds.
+
+    Updates are labelled with the name of the handler that took them, never
+    with user input, so the number of series stays bounded.
+    """
+
+    def __init__(self, slow_threshold: float = 1.0):
+        super().__init__()
+        self.slow_threshold = slow_threshold
+
+    def start(self, handler: str, data: dict):
+        stats = UpdateStats(handler)
+        data['_metrics_token'] = current_stats.set(stats)
+        data['_metrics_stats'] = stats
+
+    @staticmethod
+    def resolve(data: dict):
+        stats: UpdateStats = data.get('_metrics_stats')
+        handler = current_handler.get(None)
+        if stats is not None and handler is not None:
+            stats.handler = handler.__name__
+
+    def finish(self, data: dict):
+        stats: UpdateStats = data.pop('_metrics_stats', None)
+        if stats is None:
+            return
+        current_stats.reset(data.pop('_metrics_token'))
+        elapsed = time.monotonic() - stats.started
+        handler_seconds.observe(elapsed, handler=stats.handler)
+        handler_db_queries.observe(stats.db_queries, handler=stats.handler)
+        handler_http_requests.observe(stats.http_requests, handler=stats.handler)
+        if elapsed >= self.slow_threshold:
+            slow_handlers.inc(handler=stats.handler)
+            logger.warning(
+                "Slow handler {}: {:.3f}s, {} DB queries in {:.3f}s, {} HTTP requests in {:.3f}s",
+                stats.handler, elapsed, stats.db_queries, stats.db_seconds,
+                stats.http_requests, stats.http_seconds,
+            )
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        self.start(UNHANDLED, data)
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self.resolve(data)
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        self.finish(data)
+
+    async def on_pre_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self.start(UNHANDLED, data)
+
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self.resolve(data)
+
+    async def on_post_process_callback_query(self, callback_query: types.CallbackQuery, results, data: dict):
+        self.finish(data)
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    """
+    Serve ``/metrics`` on its own port, for the polling mode
+    """
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
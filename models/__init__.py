@@ -1,4 +1,5 @@
 from .base import *
-from .users import User, MenteeToMentor, Feedback
+from .users import User, Round, MenteeToMentor, Feedback, MentorStats
 from .chats import Chat
-from .katas import Kata, SolvedKata
+from .katas import Kata, SolvedKata, PendingSolvedKata
+from .jobs import SyncJob
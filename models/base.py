@@ -9,12 +9,22 @@ from gino import Gino
 from envparse import env
 from loguru import logger
 
+from metrics import InstrumentedConnection
+
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 env.read_envfile(os.path.join(BASE_DIR, '.env'))
 db = Gino()
 
 POSTGRES_URI = env.str('DATABASE_URI')
 
+# connection pool settings, shared by the Gino ORM and raw asyncpg queries
+POOL_MIN_SIZE = env.int('DB_POOL_MIN_SIZE', default=2)
+POOL_MAX_SIZE = env.int('DB_POOL_MAX_SIZE', default=10)
+POOL_ACQUIRE_TIMEOUT = env.float('DB_POOL_ACQUIRE_TIMEOUT', default=10.0)
+POOL_MAX_INACTIVE_LIFETIME = env.float(
+    'DB_POOL_MAX_INACTIVE_LIFETIME', default=300.0)
+STATEMENT_CACHE_SIZE = env.int('DB_STATEMENT_CACHE_SIZE', default=100)
+
 
 class BaseModel(db.Model):
     __abstract__ = True
@@ -44,9 +54,25 @@ class TimedBaseModel(BaseModel):
     )
 
 
+def acquire():
+    """
+    Borrow a connection from the shared pool.
+
+    Use ``conn.raw_connection`` for plain asyncpg queries.
+    """
+    return db.acquire(timeout=POOL_ACQUIRE_TIMEOUT)
+
+
 async def on_startup(dispatcher: Dispatcher):
     logger.info("Setup PostgreSQL Connection")
-    await db.set_bind(POSTGRES_URI)
+    await db.set_bind(
+        POSTGRES_URI,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=POOL_MAX_INACTIVE_LIFETIME,
+        statement_cache_size=STATEMENT_CACHE_SIZE,
+        connection_class=InstrumentedConnection,
+    )
     await db.gino.create_all()
 
 
@@ -0,0 +1,33 @@
+from .base import TimedBaseModel, db
+
+
+class SyncJob(TimedBaseModel):
+    """
+    A queued solutions sync of one user, see ``jobs.SyncJobQueue``
+    """
+    __tablename__ = "sync_jobs"
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    # jobs waiting or running
+    ACTIVE = f"status IN ('{QUEUED}', '{RUNNING}')"
+
+    __table_args__ = (
+        db.Index('ix_sync_jobs_status_id', 'status', 'id'),
+        # a user has at most one job waiting or running
+        db.Index('uq_sync_jobs_active_user_id', 'user_id', unique=True,
+                 postgresql_where=db.text(ACTIVE)),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.tg_id'), nullable=False)
+    full = db.Column(db.Boolean, nullable=False, server_default=db.false())
+    status = db.Column(db.String(16), nullable=False, server_default=QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, server_default='0')
+    # chat the result is posted to and the status message edited on progress
+    chat_id = db.Column(db.BigInteger, nullable=False)
+    message_id = db.Column(db.Integer, nullable=True)
+    solved = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.String, nullable=True)
@@ -7,11 +7,28 @@ class Kata(BaseModel):
     id = db.Column(db.String, primary_key=True, unique=True)
     name = db.Column(db.String)
     slug = db.Column(db.String)
+    # digest of the indexed metadata, lets the indexer skip unchanged katas
+    checksum = db.Column(db.String, nullable=True)
 
 
 class SolvedKata(BaseModel):
     __tablename__ = "solved_katas"
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'kata_id',
+                            name='uq_solved_katas_user_id_kata_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, index=True, unique=True)
-    kata_id = db.Column(db.String, db.ForeignKey('katas.id'))
+    kata_id = db.Column(db.String, db.ForeignKey('katas.id'), index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.tg_id'))
+
+
+class PendingSolvedKata(BaseModel):
+    """
+    A completion of a kata missing from the catalogue, credited as solved
+    by the catalogue indexer once the kata is added
+    """
+    __tablename__ = "pending_solved_katas"
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.tg_id', ondelete='CASCADE'), primary_key=True)
+    kata_id = db.Column(db.String, primary_key=True)
@@ -4,25 +4,78 @@ from .base import TimedBaseModel, db
 
 class User(TimedBaseModel):
     __tablename__ = "users"
+    __table_args__ = (
+        db.Index('ix_users_cohort_id_is_mentor', 'cohort_id', 'is_mentor'),
+    )
 
     tg_id = db.Column(db.Integer, primary_key=True, unique=True)
     tg_username = db.Column(db.String(50), nullable=True)
     cw_username = db.Column(db.String(50))
     is_mentor = db.Column(db.Boolean(), default=False, nullable=True)
+    # the group chat the user studies with
+    cohort_id = db.Column(db.BigInteger, db.ForeignKey('chats.id', ondelete='SET NULL'), nullable=True)
+
+    # newest Codewars completion seen by the last sync
+    last_completed_at = db.Column(db.DateTime(True), nullable=True)
+    last_completed_kata_id = db.Column(db.String, nullable=True)
+
+
+class Round(TimedBaseModel):
+    """
+    A shuffle, the latest one is the current round
+    """
+    __tablename__ = "rounds"
+    __table_args__ = (
+        db.Index('ix_rounds_cohort_id_id', 'cohort_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    cohort_id = db.Column(db.BigInteger, db.ForeignKey('chats.id', ondelete='CASCADE'), nullable=True)
 
 
 class MenteeToMentor(TimedBaseModel):
     __tablename__ = "pairs"
+    __table_args__ = (
+        db.Index('ix_pairs_round_id_mentor_id', 'round_id', 'mentor_id'),
+        db.Index('ix_pairs_round_id_mentee_id', 'round_id', 'mentee_id'),
+        db.Index('ix_pairs_cohort_id_mentee_id_mentor_id', 'cohort_id', 'mentee_id', 'mentor_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, index=True, unique=True)
     mentor_id = db.Column(db.Integer, db.ForeignKey('users.tg_id'))
     mentee_id = db.Column(db.Integer, db.ForeignKey('users.tg_id'))
+    round_id = db.Column(db.Integer, db.ForeignKey('rounds.id', ondelete='CASCADE'), nullable=False)
+    cohort_id = db.Column(db.BigInteger, db.ForeignKey('chats.id', ondelete='CASCADE'), nullable=True)
 
 
 class Feedback(TimedBaseModel):
     __tablename__ = "feedbacks"
+    __table_args__ = (
+        db.Index('ix_feedbacks_cohort_id_mentor_id', 'cohort_id', 'mentor_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, index=True, unique=True)
-    mentor_id = db.Column(db.Integer, db.ForeignKey('users.tg_id'))
+    mentor_id = db.Column(db.Integer, db.ForeignKey('users.tg_id'), index=True)
     mentee_id = db.Column(db.Integer, db.ForeignKey('users.tg_id'))
     rate = db.Column(db.Integer)
+    cohort_id = db.Column(db.BigInteger, db.ForeignKey('chats.id', ondelete='SET NULL'), nullable=True)
+
+
+class MentorStats(TimedBaseModel):
+    """
+    Running statistics of the rates given to a mentor in a cohort, ``m2`` is
+    the sum of squared deviations from the mean and ``recent`` the latest
+    rates, newest first
+    """
+    __tablename__ = "mentor_stats"
+
+    cohort_id = db.Column(db.BigInteger, db.ForeignKey('chats.id', ondelete='CASCADE'), primary_key=True)
+    mentor_id = db.Column(db.Integer, db.ForeignKey('users.tg_id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, server_default='0')
+    mean = db.Column(db.Float, nullable=False, server_default='0')
+    m2 = db.Column(db.Float, nullable=False, server_default='0')
+    recent = db.Column(db.ARRAY(db.Integer), nullable=False, server_default='{}')
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / self.count if self.count else 0.0
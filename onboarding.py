@@ -0,0 +1,176 @@
+"""
+Bulk onboarding of a cohort.
+
+Reads ``tg_id, tg_username, cw_username, is_mentor`` rows from a CSV file
+with a header or from newline-delimited JSON, checks the Codewars usernames
+concurrently and upserts the valid rows in one statement. Rows that can't
+be imported are reported with their line number and the reason.
+"""
+import asyncio
+import csv
+import io
+import json
+import typing
+
+from loguru import logger
+
+from codewars import codewars
+from config import CODEWARS_PROFILE_TTL
+from models import acquire
+from repository import user_repository
+from services import leaderboard_cache
+
+# users.tg_id is a 32-bit integer
+MAX_TG_ID = 2 ** 31 - 1
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'', '0', 'false', 'no', 'n', 'f'}
+
+
+class ImportRow(typing.NamedTuple):
+    line: int
+    tg_id: int
+    tg_username: typing.Optional[str]
+    cw_username: str
+    is_mentor: bool
+
+
+class InvalidRow(typing.NamedTuple):
+    line: int
+    reason: str
+
+
+class ImportResult(typing.NamedTuple):
+    imported: int
+    invalid: typing.List[InvalidRow]
+
+
+def read_records(text: str) -> typing.Iterator[typing.Tuple[int, dict]]:
+    """
+    (line, record) pairs of an NDJSON or CSV document
+    """
+    if text.lstrip().startswith('{'):
+        for line, row in enumerate(text.splitlines(), start=1):
+            if row.strip():
+                try:
+                    record = json.loads(row)
+                except ValueError:
+                    record = None
+                yield line, record if isinstance(record, dict) else None
+        return
+    reader = csv.DictReader(io.StringIO(text))
+    for record in reader:
+        yield reader.line_num, {key.strip(): value for key, value in record.items() if key}
+
+
+def parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    value = str(value if value is not None else '').strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f'is_mentor must be true or false, got {value!r}')
+
+
+def parse_row(line: int, record: typing.Optional[dict]) -> ImportRow:
+    if record is None:
+        raise ValueError('not a JSON object')
+    try:
+        tg_id = int(str(record.get('tg_id')).strip())
+    except ValueError:
+        raise ValueError(f"tg_id must be a number, got {record.get('tg_id')!r}")
+    if not 0 < tg_id <= MAX_TG_ID:
+        raise ValueError(f'tg_id {tg_id} is out of range')
+    cw_username = str(record.get('cw_username') or '').strip()
+    if not cw_username:
+        raise ValueError('cw_username is missing')
+    tg_username = str(record.get('tg_username') or '').strip().lstrip('@') or None
+    return ImportRow(line, tg_id, tg_username, cw_username, parse_bool(record.get('is_mentor')))
+
+
+def parse_rows(text: str) -> typing.Tuple[typing.List[ImportRow], typing.List[InvalidRow]]:
+    rows, invalid, seen = [], [], set()
+    for line, record in read_records(text):
+        try:
+            row = parse_row(line, record)
+        except ValueError as e:
+            invalid.append(InvalidRow(line, str(e)))
+            continue
+        if row.tg_id in seen:
+            invalid.append(InvalidRow(line, f'tg_id {row.tg_id} is listed twice'))
+            continue
+        seen.add(row.tg_id)
+        rows.append(row)
+    return rows, invalid
+
+
+async def check_usernames(rows: typing.List[ImportRow]) -> typing.Tuple[typing.List[ImportRow], typing.List[InvalidRow]]:
+    """
+    Split rows by whether Codewars knows their username. Lookups run
+    concurrently within the Codewars client's concurrency and rate limits.
+    """
+    usernames = list({row.cw_username for row in rows})
+    profiles = await asyncio.gather(*[
+        codewars.get_user(username, max_age=CODEWARS_PROFILE_TTL) for username in usernames
+    ], return_exceptions=True)
+    found = dict(zip(usernames, profiles))
+    valid, invalid = [], []
+    for row in rows:
+        profile = found[row.cw_username]
+        if isinstance(profile, Exception):
+            logger.warning("Failed to check Codewars user {}: {!r}", row.cw_username, profile)
+            invalid.append(InvalidRow(row.line, f"couldn't check {row.cw_username} on Codewars"))
+        elif profile is None:
+            invalid.append(InvalidRow(row.line, f'{row.cw_username} was not found on Codewars'))
+        else:
+            valid.append(row)
+    return valid, invalid
+
+
+async def upsert_users(rows: typing.List[ImportRow], cohort_id: int = None) -> int:
+    """
+    Insert new users and update known ones in one statement, moving them to
+    the cohort when one is given. Returns the number of stored rows.
+    """
+    if not rows:
+        return 0
+    async with acquire() as conn:
+        count = await conn.raw_connection.fetchval("""
+            WITH stored AS (
+                INSERT INTO users (tg_id, tg_username, cw_username, is_mentor, cohort_id)
+                SELECT *, $5::bigint FROM unnest($1::integer[], $2::varchar[], $3::varchar[], $4::boolean[])
+                ON CONFLICT (tg_id) DO UPDATE
+                SET tg_username = COALESCE(EXCLUDED.tg_username, users.tg_username),
+                    cw_username = EXCLUDED.cw_username,
+                    -- the cursor of another Codewars account is of no use
+                    last_completed_at = CASE WHEN users.cw_username IS DISTINCT FROM EXCLUDED.cw_username
+                        THEN NULL ELSE users.last_completed_at END,
+                    last_completed_kata_id = CASE WHEN users.cw_username IS DISTINCT FROM EXCLUDED.cw_username
+                        THEN NULL ELSE users.last_completed_kata_id END,
+                    is_mentor = EXCLUDED.is_mentor,
+                    cohort_id = COALESCE(EXCLUDED.cohort_id, users.cohort_id),
+                    updated_at = now()
+                RETURNING 1
+            )
+            SELECT COUNT(*) FROM stored;
+        """,
+            [row.tg_id for row in rows],
+            [row.tg_username for row in rows],
+            [row.cw_username for row in rows],
+            [row.is_mentor for row in rows],
+            cohort_id,
+        )
+    await user_repository.invalidate(*[row.tg_id for row in rows])
+    # users may have moved between cohorts
+    await leaderboard_cache.clear()
+    return count
+
+
+async def import_users(text: str, cohort_id: int = None) -> ImportResult:
+    rows, invalid = parse_rows(text)
+    rows, unknown = await check_usernames(rows)
+    imported = await upsert_users(rows, cohort_id)
+    invalid = sorted(invalid + unknown)
+    logger.info("Imported {} users, {} invalid rows", imported, len(invalid))
+    return ImportResult(imported=imported, invalid=invalid)
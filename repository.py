@@ -0,0 +1,86 @@
+import asyncio
+import typing
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from cache import MemoryCache
+from config import USER_CACHE_SIZE, USER_CACHE_TTL
+from models import User
+
+
+class UserRepository:
+    """
+    Users by Telegram id, with an in-process identity map.
+
+    Loaded users are kept for ``ttl`` seconds, so every handler of the
+    process shares one instance per user; ``create`` and ``update`` keep the
+    map in line with the database, changes made by other processes show up
+    once the entry expires. Lookups missing the map in the same event loop
+    tick are merged into a single ``tg_id = ANY(...)`` query. The query runs
+    on a connection of its own, so it doesn't see uncommitted rows of the
+    caller's transaction.
+    """
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, maxsize: int = USER_CACHE_SIZE):
+        self.users = MemoryCache(ttl=ttl, maxsize=maxsize)
+        self._pending: typing.Dict[int, asyncio.Future] = {}
+        self._flush_scheduled = False
+
+    async def get(self, tg_id: int) -> typing.Optional[User]:
+        user = await self.users.get(str(tg_id))
+        if user is not None:
+            return user
+        future = self._pending.get(tg_id)
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+            self._pending[tg_id] = future
+            self._schedule_flush()
+        # a cancelled caller doesn't fail the others waiting for the batch
+        return await asyncio.shield(future)
+
+    async def create(self, **values) -> User:
+        user = await User.create(**values)
+        await self.remember(user)
+        return user
+
+    async def update(self, user: User, **values) -> User:
+        await user.update(**values).apply()
+        await self.remember(user)
+        return user
+
+    async def remember(self, user: User):
+        """
+        Put a user loaded or stored elsewhere into the map
+        """
+        await self.users.set(str(user.tg_id), user)
+
+    async def invalidate(self, *tg_ids: int):
+        await self.users.delete(*[str(tg_id) for tg_id in tg_ids])
+
+    def _schedule_flush(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            # run after the other coroutines of this tick had their say
+            asyncio.get_event_loop().call_soon(asyncio.ensure_future, self._flush())
+
+    async def _flush(self):
+        pending, self._pending, self._flush_scheduled = self._pending, {}, False
+        try:
+            users = await User.query.where(User.tg_id == sa.any_(
+                sa.bindparam('tg_ids', list(pending), type_=ARRAY(sa.Integer)))).gino.all()
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        found = {user.tg_id: user for user in users}
+        for tg_id, future in pending.items():
+            user = found.get(tg_id)
+            if user is not None:
+                await self.users.set(str(tg_id), user)
+            if not future.done():
+                future.set_result(user)
+
+
+user_repository = UserRepository()
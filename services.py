@@ -1,35 +1,96 @@
 from models.users import Feedback
+import bisect
+import html
 import typing
 import asyncio
-import aiohttp
 import math
-import asyncpg
-import simplejson as json
 import aiogram.utils.markdown as md
 import random
-import itertools
+import time
 
-from operator import and_
-
-from exceptions import PairAlreadyExists
-from models import db, User, Kata, SolvedKata, Chat, MenteeToMentor
+from cache import make_cache
+from codewars import Progress, codewars, completed_at_of
+from repository import user_repository
+from singleflight import SingleFlight
+from models import acquire, db, User, Chat, MenteeToMentor, MentorStats, Round
 from aiogram.types.inline_keyboard import InlineKeyboardMarkup, InlineKeyboardButton
-from datetime import date, datetime
+from aiogram.utils.parts import MAX_MESSAGE_LENGTH
 from config import *
 from tabulate import tabulate
+from sqlalchemy.dialects.postgresql import insert
+from loguru import logger
+
+# number of unsolved katas listed per message
+PAGE_SIZE = 10
+
+leaderboard_cache = make_cache('leaderboard', ttl=LEADERBOARD_TTL)
+unsolved_cache = make_cache('unsolved', ttl=UNSOLVED_CACHE_TTL, maxsize=UNSOLVED_CACHE_SIZE)
+round_cache = make_cache('round', ttl=ROUND_CACHE_TTL)
+table_cache = make_cache('pairs_table', ttl=ROUND_CACHE_TTL, maxsize=PAIRS_TABLE_CACHE_SIZE)
+
+# concurrent syncs of a user and rebuilds of a cached read share one call
+sync_flight = SingleFlight('sync')
+leaderboard_flight = SingleFlight('leaderboard')
+table_flight = SingleFlight('pairs_table')
+
+
+class SyncSummary(typing.NamedTuple):
+    refreshed: int
+    failed: int
+    solved: int
+    elapsed: float
 
 
 class UserService:
 
     async def get_or_create(**kwargs):
-        user = await User.query.where(User.tg_id == kwargs.get('tg_id')).gino.first()
+        user = await user_repository.get(kwargs.get('tg_id'))
         if user is None:
-            user = await User.create(**kwargs)
+            user = await user_repository.create(**kwargs)
         return user, user != None
 
+    @staticmethod
+    async def save_codewars_username(tg_id: int, tg_username: str, cw_username: str,
+                                     cohort_id: int = None) -> User:
+        """
+        Create the user or set their usernames in one statement, the cohort
+        is kept unless a new one is given. A new Codewars account drops the
+        sync cursor of the old one.
+        """
+        query = insert(User.__table__).values(
+            tg_id=tg_id, tg_username=tg_username, cw_username=cw_username, is_mentor=False,
+            cohort_id=cohort_id,
+        )
+        changed = User.cw_username.is_distinct_from(query.excluded.cw_username)
+        query = query.on_conflict_do_update(
+            index_elements=[User.tg_id],
+            set_=dict(
+                tg_username=query.excluded.tg_username,
+                cw_username=query.excluded.cw_username,
+                cohort_id=db.func.coalesce(query.excluded.cohort_id, User.cohort_id),
+                last_completed_at=db.case([(changed, db.null())], else_=User.last_completed_at),
+                last_completed_kata_id=db.case([(changed, db.null())], else_=User.last_completed_kata_id),
+                updated_at=db.func.now(),
+            ),
+        ).returning(*User)
+        user = await db.first(query.execution_options(loader=User))
+        await user_repository.remember(user)
+        return user
+
+    @staticmethod
+    async def join_cohort(user, cohort_id: int) -> User:
+        instance = await user_repository.get(user.id)
+        if instance is None:
+            instance = await user_repository.create(tg_id=user.id, tg_username=user.username, cohort_id=cohort_id)
+        else:
+            await leaderboard_cache.delete(f'leaderboard:{instance.cohort_id}')
+            await user_repository.update(instance, cohort_id=cohort_id)
+        await leaderboard_cache.delete(f'leaderboard:{cohort_id}')
+        return instance
+
     @classmethod
-    async def get_daily_message(cls):
-        data = await cls.get_users_stats()
+    async def get_daily_message(cls, cohort_id: int):
+        data = await cls.get_users_stats(cohort_id)
         content = ["Here is a list of all of our warriors!",
                    "-----------------------------------"]
         for num, item in enumerate(data, start=1):
@@ -38,255 +99,422 @@ class UserService:
         return md.text(*content, sep='\n')
 
     @classmethod
-    async def get_users_stats(cls):
-        conn = await asyncpg.connect(POSTGRES_URI)
-        records = await conn.fetch("""
-            SELECT users.cw_username, COUNT('solved.id')
-            FROM solved_katas AS solved
-            INNER JOIN users
-                ON users.tg_id = solved.user_id
-            WHERE solved.kata_id IN (SELECT id FROM katas)
-            GROUP BY users.cw_username
-            ORDER BY COUNT('solved.id') DESC;
-        """)
-        values = [dict(record) for record in records]
-        solved = json.loads(json.dumps(values).replace("</", "<\\/"))
-        await conn.close()
-        return solved
+    async def get_users_stats(cls, cohort_id: int):
+        """
+        Number of solved katas per user of the cohort, served from the
+        leaderboard cache which is dropped whenever new solutions are stored.
+        """
+        key = f'leaderboard:{cohort_id}'
+        stats = await leaderboard_cache.get(key)
+        if stats is not None:
+            return stats
+        return await leaderboard_flight.do(key, lambda: cls.build_users_stats(cohort_id))
 
-    @classmethod
-    async def get_missing_katas(cls, user, offset=0):
-        conn = await asyncpg.connect(POSTGRES_URI)
-        records = await conn.fetch("""
-            SELECT name, slug
-            FROM katas
-            WHERE id in (
-                SELECT id
-                FROM katas
-
-                EXCEPT
+    @staticmethod
+    async def build_users_stats(cohort_id: int):
+        key = f'leaderboard:{cohort_id}'
+        # another replica may have rebuilt it while this one waited for the lock
+        stats = await leaderboard_cache.get(key)
+        if stats is not None:
+            return stats
+        async with acquire() as conn:
+            records = await conn.raw_connection.fetch("""
+                SELECT users.cw_username, COUNT('solved.id')
+                FROM solved_katas AS solved
+                INNER JOIN users
+                    ON users.tg_id = solved.user_id
+                WHERE users.cohort_id = $1 AND solved.kata_id IN (SELECT id FROM katas)
+                GROUP BY users.cw_username
+                ORDER BY COUNT('solved.id') DESC;
+            """, cohort_id)
+        stats = [dict(record) for record in records]
+        await leaderboard_cache.set(key, stats)
+        return stats
 
-                SELECT kata_id
-                FROM solved_katas
-                WHERE user_id = $1
-            )
-            LIMIT 10 OFFSET $2;
-        """, user.id, offset)
-        count = await conn.fetchrow("""
-            SELECT COUNT(*)
-            FROM katas
-            WHERE id in (
-                SELECT id
+    @staticmethod
+    async def get_unsolved_katas(user_id: int, refresh: bool = False) -> typing.List[dict]:
+        """
+        Katas the user has not solved yet, ordered by id.
+
+        The list is cached per user and dropped when new solutions of the
+        user are stored.
+        """
+        key = f'unsolved:{user_id}'
+        katas = None if refresh else await unsolved_cache.get(key)
+        if katas is not None:
+            return katas
+        async with acquire() as conn:
+            records = await conn.raw_connection.fetch("""
+                SELECT katas.id, katas.name, katas.slug
                 FROM katas
+                WHERE NOT EXISTS (
+                    SELECT 1
+                    FROM solved_katas
+                    WHERE solved_katas.user_id = $1
+                        AND solved_katas.kata_id = katas.id
+                )
+                ORDER BY katas.id COLLATE "C";
+            """, user_id)
+        katas = [dict(record) for record in records]
+        await unsolved_cache.set(key, katas)
+        return katas
 
-                EXCEPT
+    @classmethod
+    async def get_missing_katas(cls, user, cursor: str = None):
+        """
+        A page of katas the user has not solved yet.
+
+        ``cursor`` is the kata id the page starts after (``>id``) or ends
+        before (``<id``), as encoded in the pagination callback data. The
+        first page is always built from fresh data, later pages are served
+        from the per-user cache.
+        """
+        katas = await cls.get_unsolved_katas(user.id, refresh=cursor is None)
+        ids = [kata.get('id') for kata in katas]
+        if not cursor:
+            start = 0
+        elif cursor[0] == '<':
+            start = max(0, bisect.bisect_left(ids, cursor[1:]) - PAGE_SIZE)
+        else:
+            start = bisect.bisect_right(ids, cursor[1:])
+        page = katas[start:start + PAGE_SIZE]
+        has_prev, has_next = start > 0, start + PAGE_SIZE < len(katas)
+        return cls.build_missing_katas_markup(page, has_prev, has_next), len(katas)
 
-                SELECT kata_id
-                FROM solved_katas
-                WHERE user_id = $1
-            );
-        """, user.id)
-        await conn.close()
+    @staticmethod
+    def build_missing_katas_markup(katas: typing.List[dict], has_prev: bool,
+                                   has_next: bool) -> InlineKeyboardMarkup:
         markup = InlineKeyboardMarkup()
-        for r in records:
-            btn = InlineKeyboardButton(text=r.get('name'),
-                                       url=f"{CODEWARS_BASE_KATA_URL}/{r.get('slug')}/")
+        for kata in katas:
+            btn = InlineKeyboardButton(text=kata.get('name'),
+                                       url=f"{CODEWARS_BASE_KATA_URL}/{kata.get('slug')}/")
             markup.add(btn)
         buttons = []
-        if not count.get('count') - offset <= 10:
+        if not katas:
+            return markup
+        if has_next:
             buttons.append(InlineKeyboardButton(
-                text='Далее', callback_data=f'next_{offset + 10}'))
-        if offset > 0:
+                text='Далее', callback_data=f"next_>{katas[-1].get('id')}"))
+        if has_prev:
             buttons.append(InlineKeyboardButton(
-                text='Назад', callback_data=f'next_{offset - 10}'))
+                text='Назад', callback_data=f"next_<{katas[0].get('id')}"))
         if buttons:
             markup.add(*buttons)
-        return markup, count.get('count')
+        return markup
 
-    async def get_total_pages(user):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f'{CODEWARS_BASE_URL}/{user.cw_username}/code-challenges/completed?page=0') as resp:
-                resp = await resp.json()
-                return resp.get('totalPages')
+    @staticmethod
+    async def save_solved_katas(user, kata_ids: typing.Iterable[str]) -> int:
+        """
+        Store the given katas as solved by the user in one statement.
+
+        Already stored solutions are skipped, katas missing from the
+        catalogue are kept pending until the catalogue indexer adds them, so
+        the sync cursor can move past them. Returns the number of newly
+        stored solutions.
+        """
+        async with acquire() as conn:
+            return await conn.raw_connection.fetchval("""
+                WITH pending AS (
+                    INSERT INTO pending_solved_katas (user_id, kata_id)
+                    SELECT DISTINCT $1::integer, kata_id
+                    FROM unnest($2::varchar[]) AS kata_id
+                    WHERE NOT EXISTS (SELECT 1 FROM katas WHERE katas.id = kata_id)
+                    ON CONFLICT DO NOTHING
+                ),
+                inserted AS (
+                    INSERT INTO solved_katas (kata_id, user_id)
+                    SELECT katas.id, $1
+                    FROM katas
+                    WHERE katas.id = ANY($2::varchar[])
+                    ON CONFLICT (user_id, kata_id) DO NOTHING
+                    RETURNING 1
+                )
+                SELECT COUNT(*) FROM inserted;
+            """, user.tg_id, list(kata_ids))
 
     @classmethod
-    async def get_user_solved_katas(cls, user):
-        # pages = math.ceil(await cls.get_total_items(user) / 200)
-        user = await User.query.where(User.tg_id == user.id).gino.first()
-        count = await cls.extract_solved_katas(user)
-        return count
-
-    async def get_katas(url):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                resp = await resp.json()
-                return resp.get('data')
+    async def extract_solved_katas(cls, user, full: bool = False, progress: Progress = None):
+        """
+        Sync katas solved by the user on Codewars.
+
+        Only completions newer than the ones seen by the previous sync are
+        fetched unless ``full`` is set. ``progress`` is awaited as pages are
+        fetched. A sync of the user already in flight is awaited instead of
+        starting another one.
+        """
+        return await sync_flight.do(
+            f'{user.tg_id}:{full}', lambda: cls.sync_solved_katas(user, full, progress))
 
     @classmethod
-    async def extract_solved_katas(cls, user):
-        pages = await cls.get_total_pages(user)
-        count = 0
-        for page in range(pages):
-            url = f"{CODEWARS_BASE_URL}/{user.cw_username}/code-challenges/completed?page={page}"
-            katas = await cls.get_katas(url)
-            for kata in katas:
-                instance = await Kata.query.where(Kata.id == kata.get('id')).gino.first()
-                exists = await SolvedKata.query.where(and_(SolvedKata.user_id == user.tg_id, SolvedKata.kata_id == kata.get('id'))).gino.first()
-                if exists is None and instance is not None:
-                    await SolvedKata.create(kata_id=instance.id, user_id=user.tg_id)
-                    count += 1
+    async def sync_solved_katas(cls, user, full: bool = False, progress: Progress = None):
+        if full or user.last_completed_at is None:
+            pages = await codewars.get_completed_pages(user.cw_username, progress)
+            katas = [kata for page in pages for kata in page.get('data') or []]
+        else:
+            katas = await codewars.get_completed_since(
+                user.cw_username, user.last_completed_at, user.last_completed_kata_id, progress)
+        count = await cls.save_solved_katas(user, {kata.get('id') for kata in katas})
+        if count:
+            await leaderboard_cache.delete(f'leaderboard:{user.cohort_id}')
+            await unsolved_cache.delete(f'unsolved:{user.tg_id}')
+        if katas:
+            latest = katas[0]
+            await user_repository.update(
+                user,
+                last_completed_at=completed_at_of(latest),
+                last_completed_kata_id=latest.get('id'),
+            )
         return count
 
     @classmethod
-    async def extract_solved_katas_in_bulk(cls):
-        users = await User.query.gino.all()
+    async def extract_solved_katas_in_bulk(cls, workers: int = SYNC_WORKERS) -> 'SyncSummary':
+        """
+        Sync solved katas of every user through a pool of workers.
+
+        A failing user is logged and skipped without stopping the others.
+        """
+        users = await User.query.where(User.cw_username != None).gino.all()
+        queue = asyncio.Queue()
         for user in users:
-            await cls.extract_solved_katas(user)
+            queue.put_nowait(user)
+        started = time.monotonic()
+        refreshed, failed, solved = 0, 0, 0
+
+        async def worker():
+            nonlocal refreshed, failed, solved
+            while not queue.empty():
+                user = queue.get_nowait()
+                try:
+                    solved += await cls.extract_solved_katas(user)
+                    refreshed += 1
+                except Exception:
+                    failed += 1
+                    logger.exception("Failed to sync solutions of {}", user.cw_username)
+                done = refreshed + failed
+                if done % 10 == 0 or done == len(users):
+                    logger.info("Synced solutions of {}/{} users", done, len(users))
+
+        await asyncio.gather(*[worker() for _ in range(max(1, min(workers, len(users))))])
+        return SyncSummary(
+            refreshed=refreshed,
+            failed=failed,
+            solved=solved,
+            elapsed=time.monotonic() - started,
+        )
 
 
 class ChatService:
 
-    async def get_chat():
-        return await Chat.query.limit(1).gino.first()
+    async def get_chats():
+        return await Chat.query.gino.all()
 
     async def set_chat(chat):
-        chat = await Chat.create(id=chat.id, chat_type=chat.type)
-        return chat
+        """
+        Register the chat as a cohort, a chat registered before is kept as is
+        """
+        query = insert(Chat.__table__).values(id=chat.id, chat_type=chat.type)
+        query = query.on_conflict_do_update(
+            index_elements=[Chat.id],
+            set_=dict(chat_type=query.excluded.chat_type, updated_at=db.func.now()),
+        ).returning(*Chat)
+        return await db.first(query.execution_options(loader=Chat))
 
 
 class MentorService:
 
     model = User
 
-    async def make_me_mentor(user):
-        instance = await User.query.where(User.tg_id == user.id).gino.first()
+    async def make_me_mentor(user, cohort_id: int = None):
+        """
+        Make the user a mentor, moving them to the cohort when one is given
+        """
+        values = dict(is_mentor=True)
+        if cohort_id is not None:
+            values['cohort_id'] = cohort_id
+        instance = await user_repository.get(user.id)
         if instance is None:
-            await User.create(tg_id=user.id, tg_username=user.username, is_mentor=True)
+            await user_repository.create(tg_id=user.id, tg_username=user.username, **values)
         else:
-            await instance.update(is_mentor=True).apply()
+            if cohort_id is not None and instance.cohort_id != cohort_id:
+                await leaderboard_cache.delete(f'leaderboard:{instance.cohort_id}', f'leaderboard:{cohort_id}')
+            await user_repository.update(instance, **values)
 
-    async def get_mentors():
-        return await User.query.where(User.is_mentor == True).gino.all()
+    async def get_mentors(cohort_id: int):
+        return await User.query.where(db.and_(User.cohort_id == cohort_id, User.is_mentor == True)).gino.all()
 
-    async def list_mentees():
-        return await User.query.where(User.is_mentor == False).gino.all()
+    async def list_mentees(cohort_id: int):
+        return await User.query.where(db.and_(User.cohort_id == cohort_id, User.is_mentor == False)).gino.all()
 
-    async def get_number_of_mentees(mentor: User):
-        query = db.text(
-            """
-            SELECT mentor.tg_username AS mentor, COUNT(mentee.tg_id)
-            FROM pairs
-            INNER JOIN users AS mentor
-                ON pairs.mentor_id = mentor.tg_id
-            INNER JOIN users AS mentee
-                ON pairs.mentee_id = mentee.tg_id
-            WHERE mentor.tg_id = :mentor_id AND pairs.created_at::date = (
-                SELECT MAX(created_at::date)
-                FROM pairs
-            )
-            GROUP BY mentor.tg_username;
-            """
-        )
-        data = await db.first(query, mentor_id=mentor.tg_id)
-        return data.count if data is not None else 0
+    @staticmethod
+    async def get_current_round(cohort_id: int) -> typing.Optional[int]:
+        """
+        Id of the latest round of the cohort, cached until the next shuffle
+        """
+        key = f'current:{cohort_id}'
+        round_id = await round_cache.get(key)
+        if round_id is None:
+            round_id = await db.select([db.func.max(Round.id)]).where(Round.cohort_id == cohort_id).gino.scalar()
+            if round_id is not None:
+                await round_cache.set(key, round_id)
+        return round_id
 
-    @classmethod
-    async def get_random_mentor(cls):
-        mentors = await cls.get_mentors()
-        query = db.text("""
-            SELECT COUNT(*)
-            FROM users
-            WHERE is_mentor = false;
-        """)
-        total = await db.first(query)
-        weights = [
-            abs(total.count - await cls.get_number_of_mentees(mentor)) for mentor in mentors]
-        return random.choices(mentors, weights).pop()
+    @staticmethod
+    async def get_pair_history(cohort_id: int) -> typing.Set[typing.Tuple[int, int]]:
+        """
+        Every (mentor_id, mentee_id) pair ever made in the cohort
+        """
+        rows = await db.select([MenteeToMentor.mentor_id, MenteeToMentor.mentee_id]).where(
+            MenteeToMentor.cohort_id == cohort_id).distinct().gino.all()
+        return {(row.mentor_id, row.mentee_id) for row in rows}
 
-    @classmethod
-    async def get_random_mentee(cls):
-        conn = await asyncpg.connect(POSTGRES_URI)
-        query = await conn.fetch("""
-            SELECT tg_id
-            FROM users
-            WHERE users.tg_id not in (SELECT mentee_id FROM pairs WHERE created_at::date = (SELECT MAX(created_at::date) FROM pairs)) AND is_mentor = false;
-        """)
-        await conn.close()
-        mentees = [record.get('tg_id') for record in query]
-        return await User.query.where(User.tg_id == random.choice(mentees)).gino.first()
+    @staticmethod
+    async def get_mentor_stats(cohort_id: int) -> typing.Dict[int, MentorStats]:
+        return {stats.mentor_id: stats
+                for stats in await MentorStats.query.where(MentorStats.cohort_id == cohort_id).gino.all()}
+
+    @staticmethod
+    def mentor_rating(stats: typing.Optional[MentorStats]) -> float:
+        """
+        Mean of the recent rates pulled towards the middle of the scale, so
+        that a couple of rates don't decide much
+        """
+        neutral = (MIN_RATE + MAX_RATE) / 2
+        recent = stats.recent if stats is not None else []
+        return (sum(recent) + neutral * MENTOR_RATING_PRIOR) / (len(recent) + MENTOR_RATING_PRIOR)
 
     @classmethod
-    async def find_pair(cls, mentor: User, mentee: User):
-        return await MenteeToMentor.query.where(MenteeToMentor.mentor_id == mentor.tg_id and MenteeToMentor.mentee_id == mentee.tg_id).gino.first()
+    async def get_mentor_ratings(cls, cohort_id: int) -> typing.Dict[int, float]:
+        return {mentor_id: cls.mentor_rating(stats)
+                for mentor_id, stats in (await cls.get_mentor_stats(cohort_id)).items()}
 
     @classmethod
-    async def delete_previous_pairs(cls):
-        max_date = await db.func.max(MenteeToMentor.created_at).gino.scalar()
-        await MenteeToMentor.delete.where(db.cast(MenteeToMentor.created_at, db.Date) == max_date).gino.status()
+    def mentor_weight(cls, load: int, total: int, rating: typing.Optional[float] = None) -> float:
+        # the fewer mentees a mentor has, the more likely they get the next one,
+        # better rated mentors are more likely too
+        if rating is None:
+            rating = cls.mentor_rating(None)
+        return max(total - load, 1) * rating / MAX_RATE
 
     @classmethod
-    async def is_mentor_available(cls, mentor: User):
-        today = datetime.now().date()
-        return await MenteeToMentor.query.where(db.cast(MenteeToMentor.created_at, db.Date) == today and MenteeToMentor.mentor_id == mentor.tg_id).gino.first() is None
+    async def delete_previous_pairs(cls, cohort_id: int):
+        """
+        Drop the latest round of the cohort, its pairs go with it
+        """
+        round_id = await cls.get_current_round(cohort_id)
+        if round_id is None:
+            return
+        await Round.delete.where(Round.id == round_id).gino.status()
+        await round_cache.delete(f'current:{cohort_id}')
 
-    @staticmethod
-    async def number_of_available_mentors():
-        query = db.text("""
-            SELECT COUNT(*)
-            FROM users
-            WHERE is_mentor = true AND tg_id in (SELECT mentor_id FROM pairs WHERE created_at::date = CURRENT_DATE);
-        """)
-        total = await db.first(query)
-        return total.count
+    @classmethod
+    def assign_mentors(cls, mentees: typing.List[User], mentors: typing.List[User],
+                       history: typing.Set[typing.Tuple[int, int]],
+                       ratings: typing.Dict[int, float] = None) -> typing.List[typing.Tuple[User, User]]:
+        """
+        Pick a mentor for every mentee in memory.
+
+        Every mentor takes at most ceil(mentees / mentors) mentees. Mentors
+        the mentee has already been paired with are only picked when no
+        other mentor has room left, and less loaded and better rated
+        mentors are more likely to be picked.
+        """
+        if not mentors:
+            return []
+        ratings = ratings or {}
+        capacity = math.ceil(len(mentees) / len(mentors))
+        loads = {mentor.tg_id: 0 for mentor in mentors}
+        pairs = []
+        for mentee in random.sample(mentees, len(mentees)):
+            available = [mentor for mentor in mentors if loads[mentor.tg_id] < capacity]
+            candidates = [mentor for mentor in available
+                          if (mentor.tg_id, mentee.tg_id) not in history] or available
+            weights = [cls.mentor_weight(loads[mentor.tg_id], len(mentees), ratings.get(mentor.tg_id))
+                       for mentor in candidates]
+            mentor = random.choices(candidates, weights).pop()
+            loads[mentor.tg_id] += 1
+            pairs.append((mentor, mentee))
+        return pairs
 
     @classmethod
-    async def distribute_users(cls):
-        # TODO
-        # 1) add limit on amount of mentees
-        # 2) add probability system
-        mentees = await cls.list_mentees()
-        mentors = await cls.get_mentors()
-
-        random.shuffle(mentors)
-
-        for mentee in mentees:
-            _mentor = None
-            for mentor in mentors:
-                pair = await cls.find_pair(mentor, mentee)
-                if pair is not None:
-                    continue
-                elif cls.is_mentor_available(mentor):
-                    _mentor = mentor
-                    break
-            else:
-                _mentor = await cls.get_random_mentor()
-            await MenteeToMentor.create(mentor_id=_mentor.tg_id, mentee_id=mentee.tg_id)
+    async def distribute_users(cls, cohort_id: int):
+        mentees = await cls.list_mentees(cohort_id)
+        mentors = await cls.get_mentors(cohort_id)
+        history = await cls.get_pair_history(cohort_id)
+        ratings = await cls.get_mentor_ratings(cohort_id)
+
+        pairs = cls.assign_mentors(mentees, mentors, history, ratings)
+        if not pairs:
+            return
+        async with db.transaction():
+            new_round = await Round.create(cohort_id=cohort_id)
+            await MenteeToMentor.insert().values([
+                dict(mentor_id=mentor.tg_id, mentee_id=mentee.tg_id, round_id=new_round.id, cohort_id=cohort_id)
+                for mentor, mentee in pairs
+            ]).gino.status()
+        await round_cache.set(f'current:{cohort_id}', new_round.id)
 
     @classmethod
-    async def get_latest_list(cls):
-        conn = await asyncpg.connect(POSTGRES_URI)
-        query = await conn.fetch("""
-            SELECT mentor.tg_username AS mentor, mentee.tg_username AS mentee
-            FROM pairs
-            INNER JOIN users AS mentor
-                ON pairs.mentor_id = mentor.tg_id
-            INNER JOIN users AS mentee
-                ON pairs.mentee_id = mentee.tg_id
-            WHERE pairs.created_at::date = (
-                SELECT MAX(created_at::date)
+    async def get_latest_list(cls, cohort_id: int):
+        round_id = await cls.get_current_round(cohort_id)
+        async with acquire() as conn:
+            query = await conn.raw_connection.fetch("""
+                SELECT mentor.tg_username AS mentor, mentee.tg_username AS mentee
                 FROM pairs
-            );
-        """)
-        await conn.close()
+                INNER JOIN users AS mentor
+                    ON pairs.mentor_id = mentor.tg_id
+                INNER JOIN users AS mentee
+                    ON pairs.mentee_id = mentee.tg_id
+                WHERE pairs.round_id = $1
+                ORDER BY pairs.id;
+            """, round_id)
         return [(num, record.get('mentor'), record.get('mentee'))
                 for num, record in enumerate(query, start=1)]
 
+    @staticmethod
+    def split_table(table: str, limit: int = MAX_MESSAGE_LENGTH) -> typing.List[str]:
+        """
+        Split a rendered table into ``<pre>`` messages of at most ``limit``
+        characters, every message repeating the header
+        """
+        lines = html.escape(table).split('\n')
+        if len(lines) <= 4:
+            return ['<pre>{}</pre>'.format('\n'.join(lines))]
+        # a "pretty" table starts with border, header, border and ends with a border
+        header, rows, footer = lines[:3], lines[3:-1], lines[-1:]
+        overhead = len('<pre></pre>') + sum(len(line) + 1 for line in header + footer)
+        chunks, chunk, size = [], [], overhead
+        for row in rows:
+            if chunk and size + len(row) + 1 > limit:
+                chunks.append(chunk)
+                chunk, size = [], overhead
+            chunk.append(row)
+            size += len(row) + 1
+        chunks.append(chunk)
+        return ['<pre>{}</pre>'.format('\n'.join(header + chunk + footer)) for chunk in chunks]
+
     @classmethod
-    async def generate_table(cls):
-        headers = ["#", "Mentor", "Mentee"]
-        table = await cls.get_latest_list()
-        pairs = tabulate(table, headers, tablefmt="pretty")
-        return f'<pre>{pairs}</pre>'
+    async def generate_table(cls, cohort_id: int) -> typing.List[str]:
+        """
+        Messages listing the pairs of the cohort's current round, rendered
+        once per round
+        """
+        round_id = await cls.get_current_round(cohort_id)
+        key = f'table:{cohort_id}:{round_id}'
+        messages = await table_cache.get(key)
+        if messages is not None:
+            return messages
+
+        async def render():
+            messages = await table_cache.get(key)
+            if messages is not None:
+                return messages
+            headers = ["#", "Mentor", "Mentee"]
+            table = await cls.get_latest_list(cohort_id)
+            messages = cls.split_table(tabulate(table, headers, tablefmt="pretty"))
+            await table_cache.set(key, messages)
+            return messages
+
+        return await table_flight.do(key, render)
 
     @staticmethod
     async def generate_rate_markup():
@@ -296,34 +524,92 @@ class MentorService:
                      for num in range(MIN_RATE, MAX_RATE + 1)])
         return markup
 
-    @staticmethod
-    async def get_current_mentor(mentee: User) -> User:
+    @classmethod
+    async def get_current_mentor(cls, mentee: User) -> User:
+        round_id = await cls.get_current_round(mentee.cohort_id)
         query = db.text("""
             SELECT mentor.tg_id, mentor.tg_username
             FROM pairs
             INNER JOIN users AS mentor
                 ON mentor.tg_id = pairs.mentor_id
-            WHERE pairs.mentee_id = :mentee_id AND pairs.created_at::date = (
-                SELECT MAX(created_at::date)
-                FROM pairs
-            );
+            WHERE pairs.mentee_id = :mentee_id AND pairs.round_id = :round_id;
         """)
-        mentor = await db.first(query, mentee_id=mentee.tg_id)
+        mentor = await db.first(query, mentee_id=mentee.tg_id, round_id=round_id)
         return mentor
 
-    @classmethod
-    async def get_reminder_message(cls, mentee: User) -> str:
-        mentor = await cls.get_current_mentor(mentee)
-        base = f"Please, rate @{mentor.tg_username}'s work"
+    @staticmethod
+    def reminder_text(mentor_username: str) -> str:
+        base = f"Please, rate @{mentor_username}'s work"
         return md.text(base, "<pre>Don't worry.\nIt's all confidential</pre>", sep='\n\n')
 
+    @classmethod
+    async def get_reminders(cls) -> typing.List[typing.Tuple[int, str]]:
+        """
+        (mentee_id, text) reminders to rate the current mentor for every
+        mentee of the latest round of every cohort, built from one query
+        """
+        query = db.text("""
+            SELECT pairs.mentee_id, mentor.tg_username
+            FROM pairs
+            INNER JOIN users AS mentor
+                ON mentor.tg_id = pairs.mentor_id
+            INNER JOIN users AS mentee
+                ON mentee.tg_id = pairs.mentee_id
+            WHERE mentee.is_mentor = false AND pairs.round_id IN (
+                SELECT MAX(id)
+                FROM rounds
+                GROUP BY cohort_id
+            );
+        """)
+        return [(row.mentee_id, cls.reminder_text(row.tg_username))
+                for row in await db.all(query)]
+
     @staticmethod
-    async def rate_mentor(mentee_id: int, mentor_id: int, rate: int):
-        await Feedback.create(
-            mentee_id=mentee_id,
-            mentor_id=mentor_id,
-            rate=rate)
+    async def rate_mentor(mentee_id: int, mentor_id: int, rate: int, cohort_id: int):
+        """
+        Store the feedback and fold the rate into the mentor's statistics in
+        the cohort, the mean and variance are updated with Welford's method
+        """
+        async with db.transaction() as tx:
+            await Feedback.create(
+                mentee_id=mentee_id,
+                mentor_id=mentor_id,
+                rate=rate,
+                cohort_id=cohort_id)
+            await tx.connection.raw_connection.execute("""
+                INSERT INTO mentor_stats (cohort_id, mentor_id, count, mean, m2, recent)
+                VALUES ($4, $1, 1, $2::integer, 0, ARRAY[$2::integer])
+                ON CONFLICT (cohort_id, mentor_id) DO UPDATE SET
+                    count = mentor_stats.count + 1,
+                    mean = mentor_stats.mean + ($2::integer - mentor_stats.mean) / (mentor_stats.count + 1),
+                    m2 = mentor_stats.m2 + ($2::integer - mentor_stats.mean)
+                        * ($2::integer - mentor_stats.mean - ($2::integer - mentor_stats.mean) / (mentor_stats.count + 1)),
+                    recent = (ARRAY[$2::integer] || mentor_stats.recent)[1:$3],
+                    updated_at = now();
+            """, mentor_id, rate, MENTOR_STATS_WINDOW, cohort_id)
+
+    @classmethod
+    async def generate_stats_table(cls, cohort_id: int, mentor_id: int = None) -> typing.List[str]:
+        """
+        Messages with the rating statistics of every mentor of the cohort, or
+        of the given one
+        """
+        query = MentorStats.join(User, User.tg_id == MentorStats.mentor_id).select().where(
+            MentorStats.cohort_id == cohort_id)
+        if mentor_id is not None:
+            query = query.where(MentorStats.mentor_id == mentor_id)
+        rows = await query.order_by(MentorStats.mean.desc()).gino.load(
+            (MentorStats, User.tg_username)).all()
+        if not rows:
+            return []
+        headers = ["Mentor", "Rates", "Mean", "Std", "Recent"]
+        table = [
+            (username, stats.count, f'{stats.mean:.2f}', f'{math.sqrt(stats.variance):.2f}',
+             f'{sum(stats.recent) / len(stats.recent):.2f}' if stats.recent else '-')
+            for stats, username in rows
+        ]
+        return cls.split_table(tabulate(table, headers, tablefmt="pretty"))
 
     @staticmethod
     async def get_mentee(mentee_id: int):
-        return await User.query.where(User.tg_id == mentee_id).gino.first()
+        return await user_repository.get(mentee_id)
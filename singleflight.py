@@ -0,0 +1,82 @@
+import asyncio
+import time
+import typing
+import uuid
+
+from aioredis import Redis
+from loguru import logger
+
+from cache import get_redis
+from config import REDIS_HOST, SINGLEFLIGHT_LOCK_TTL, SINGLEFLIGHT_POLL_INTERVAL
+
+T = typing.TypeVar('T')
+
+# deletes the lock only if it is still held by the given token
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls of the same operation.
+
+    While a call for a key is in flight, callers of ``do`` with the same key
+    await its result instead of starting another one. When Redis is
+    configured the call also holds a lock shared by every bot instance, so
+    replicas run it one after another; callers should re-check their cache
+    inside ``fn`` to pick up what another replica has just computed.
+    """
+
+    def __init__(self, namespace: str, lock_ttl: float = SINGLEFLIGHT_LOCK_TTL,
+                 poll_interval: float = SINGLEFLIGHT_POLL_INTERVAL):
+        self.namespace = namespace
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self._calls: typing.Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: typing.Callable[[], typing.Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, fn))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # a cancelled caller doesn't cancel the call the others wait for
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # retrieved by the callers, don't let asyncio log it again
+            task.exception()
+
+    async def _run(self, key: str, fn: typing.Callable[[], typing.Awaitable[T]]) -> T:
+        if not REDIS_HOST:
+            return await fn()
+        redis = await get_redis()
+        lock_key = f'lock:{self.namespace}:{key}'
+        token = await self._acquire(redis, lock_key)
+        try:
+            return await fn()
+        finally:
+            if token is not None:
+                await redis.eval(RELEASE_SCRIPT, keys=[lock_key], args=[token])
+
+    async def _acquire(self, redis: Redis, lock_key: str) -> typing.Optional[str]:
+        """
+        Wait for the lock, returns None when it is still taken after ``lock_ttl``
+        """
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_ttl
+        while True:
+            if await redis.set(lock_key, token, pexpire=int(self.lock_ttl * 1000),
+                               exist=Redis.SET_IF_NOT_EXIST):
+                return token
+            if time.monotonic() >= deadline:
+                logger.warning("Gave up waiting for lock {}", lock_key)
+                return None
+            await asyncio.sleep(self.poll_interval)
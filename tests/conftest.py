@@ -0,0 +1,81 @@
+"""
+Tests of the Redis-backed paths run against the Redis at ``REDIS_HOST``
+(``localhost`` by default, database 15), query plan tests against the
+Postgres database at ``DATABASE_URI``. Either is skipped when its server
+can't be reached::
+
+    docker run --rm -p 6379:6379 redis:6-alpine
+    docker run --rm -p 5432:5432 -e POSTGRES_DB=codewars_test -e POSTGRES_HOST_AUTH_METHOD=trust postgres:12-alpine
+    pytest
+"""
+import asyncio
+import contextlib
+import os
+import typing
+
+import pytest
+
+# config reads these on import, the tests never talk to Telegram
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ.setdefault('DATABASE_URI', 'postgresql://postgres@localhost/codewars_test')
+os.environ.setdefault('WEBHOOK_URL', 'http://localhost')
+os.environ.setdefault('WEBHOOK_HOST', 'http://localhost')
+os.environ.setdefault('CREATOR_ID', '0')
+os.environ.setdefault('REDIS_HOST', 'localhost')
+os.environ.setdefault('REDIS_DB', '15')
+
+import aioredis  # noqa: E402
+import asyncpg  # noqa: E402
+
+from cache import close_redis, get_redis  # noqa: E402
+from models import POSTGRES_URI, db  # noqa: E402
+
+
+def run(coro: typing.Awaitable):
+    """
+    Run a test coroutine in a loop of its own, the shared Redis pool is
+    bound to the loop so it is closed before the loop goes away
+    """
+    async def main():
+        try:
+            return await coro
+        finally:
+            await close_redis()
+
+    return asyncio.run(main())
+
+
+@contextlib.asynccontextmanager
+async def database():
+    """
+    Bind the models to the test database for the duration of the block
+    """
+    await db.set_bind(POSTGRES_URI)
+    try:
+        await db.gino.create_all()
+        yield db
+    finally:
+        await db.pop_bind().close()
+
+
+@pytest.fixture(scope='session')
+def redis():
+    async def ping():
+        await (await get_redis()).ping()
+
+    try:
+        run(asyncio.wait_for(ping(), 2))
+    except (OSError, asyncio.TimeoutError, aioredis.RedisError) as e:
+        pytest.skip(f'Redis is not reachable: {e!r}')
+
+
+@pytest.fixture(scope='session')
+def postgres():
+    async def ping():
+        conn = await asyncpg.connect(POSTGRES_URI)
+        await conn.close()
+
+    try:
+        run(asyncio.wait_for(ping(), 5))
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        pytest.skip(f'Postgres is not reachable: {e!r}')
@@ -0,0 +1,79 @@
+import asyncio
+import uuid
+
+from cache import RedisCache, get_redis, make_cache
+from tests.conftest import run
+
+
+def make_namespace() -> str:
+    return f'test-{uuid.uuid4().hex}'
+
+
+def test_round_trips_json(redis):
+    async def main():
+        cache = RedisCache(make_namespace())
+        value = {'name': 'Ката', 'ids': [1, 2.5, 'x'], 'nested': {'ok': True, 'none': None}}
+        await cache.set('key', value)
+        assert await cache.get('key') == value
+        assert await cache.get('missing') is None
+        assert await cache.get('missing', default=[]) == []
+        await cache.clear()
+
+    run(main())
+
+
+def test_entries_expire_after_ttl(redis):
+    async def main():
+        cache = RedisCache(make_namespace(), ttl=0.2)
+        await cache.set('default', 1)
+        await cache.set('longer', 2, ttl=60)
+        assert await cache.get('default') == 1
+        await asyncio.sleep(0.4)
+        assert await cache.get('default') is None
+        assert await cache.get('longer') == 2
+        await cache.clear()
+
+    run(main())
+
+
+def test_entries_without_ttl_dont_expire(redis):
+    async def main():
+        cache = RedisCache(make_namespace())
+        await cache.set('key', 1)
+        redis = await get_redis()
+        assert await redis.pttl(cache.make_key('key')) == -1
+        await cache.clear()
+
+    run(main())
+
+
+def test_delete(redis):
+    async def main():
+        cache = RedisCache(make_namespace())
+        for key in 'abc':
+            await cache.set(key, key)
+        await cache.delete('a', 'b')
+        await cache.delete()
+        assert await cache.get('a') is None
+        assert await cache.get('b') is None
+        assert await cache.get('c') == 'c'
+        await cache.clear()
+
+    run(main())
+
+
+def test_clear_keeps_other_namespaces(redis):
+    async def main():
+        cleared, kept = RedisCache(make_namespace()), RedisCache(make_namespace())
+        await cleared.set('key', 1)
+        await kept.set('key', 2)
+        await cleared.clear()
+        assert await cleared.get('key') is None
+        assert await kept.get('key') == 2
+        await kept.clear()
+
+    run(main())
+
+
+def test_make_cache_uses_redis_when_configured():
+    assert isinstance(make_cache('leaderboard', ttl=60), RedisCache)
@@ -0,0 +1,39 @@
+import uuid
+
+from catalogue import checksum, unique_katas, upsert_katas
+from models import Kata
+from tests.conftest import database, run
+
+
+def kata(kata_id: str, name: str = 'Kata') -> dict:
+    return {'id': kata_id, 'name': name, 'slug': name.lower()}
+
+
+def test_unique_katas_keeps_the_last_entry_of_an_id():
+    katas = [kata('a', 'First'), None, kata('b'), {'name': 'no id'}, kata('a', 'Second')]
+    assert unique_katas(katas) == [kata('a', 'Second'), kata('b')]
+
+
+def test_checksum_follows_metadata():
+    assert checksum(kata('a', 'First')) == checksum(kata('a', 'First'))
+    assert checksum(kata('a', 'First')) != checksum(kata('a', 'Second'))
+
+
+def test_upsert_stores_a_batch_repeating_a_kata(postgres):
+    prefix = f'test-{uuid.uuid4().hex[:8]}'
+
+    async def main():
+        async with database():
+            try:
+                stored, inserted = await upsert_katas([
+                    kata(f'{prefix}-a', 'First'), kata(f'{prefix}-b'), kata(f'{prefix}-a', 'Second'),
+                ])
+                assert (stored, inserted) == (2, 2)
+                assert (await Kata.get(f'{prefix}-a')).name == 'Second'
+                # unchanged katas are skipped, changed ones are updated
+                stored, inserted = await upsert_katas([kata(f'{prefix}-a', 'Third'), kata(f'{prefix}-b')])
+                assert (stored, inserted) == (1, 0)
+            finally:
+                await Kata.delete.where(Kata.id.like(f'{prefix}-%')).gino.status()
+
+    run(main())
@@ -0,0 +1,78 @@
+import datetime
+import typing
+
+from benchmarks.codewars_stub import EPOCH, CodewarsStub, kata_id, serve
+from codewars import CodewarsClient
+from tests.conftest import run
+
+# 450 completions served in 3 pages, number 0 is the oldest
+USERNAME = 'warrior-450'
+
+
+def number_of(kata: dict) -> int:
+    return int(kata['name'].split('#')[1])
+
+
+class TiedStub(CodewarsStub):
+    """
+    Completions come in pairs sharing the same completedAt
+    """
+
+    def completions(self, username: str, page: int) -> dict:
+        resp = super().completions(username, page)
+        for kata in resp['data']:
+            number = number_of(kata)
+            completed_at = EPOCH + datetime.timedelta(hours=number // 2)
+            kata['completedAt'] = completed_at.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        return resp
+
+
+def completed_since(stub: CodewarsStub, completed_at: datetime.datetime,
+                    kata: str) -> typing.Tuple[typing.List[int], int]:
+    """
+    Numbers of the fetched completions and the number of fetched pages
+    """
+    async def main():
+        runner = await serve(stub, 'localhost', 0)
+        port = runner.addresses[0][1]
+        client = CodewarsClient(base_url=f'http://localhost:{port}/api/v1/users', retry_backoff=0)
+        pages = []
+
+        async def progress(done: int, total: typing.Optional[int]):
+            assert total is None
+            pages.append(done)
+
+        try:
+            katas = await client.get_completed_since(USERNAME, completed_at, kata, progress)
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return [number_of(kata) for kata in katas], len(pages)
+
+    return run(main())
+
+
+def hours(number: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(hours=number)
+
+
+def test_nothing_new_stops_at_the_first_completion():
+    assert completed_since(CodewarsStub(), hours(449), kata_id(449)) == ([], 1)
+
+
+def test_paging_stops_at_the_cursor():
+    numbers, pages = completed_since(CodewarsStub(), hours(240), kata_id(240))
+    assert numbers == list(range(449, 240, -1))
+    assert pages == 2
+
+
+def test_cursor_older_than_the_history_fetches_every_page():
+    numbers, pages = completed_since(CodewarsStub(), hours(-1), kata_id(-1))
+    assert numbers == list(range(449, -1, -1))
+    assert pages == 3
+
+
+def test_completion_tied_with_the_cursor_is_kept():
+    # 301 and 300 are completed at the same time, 301 is listed first
+    assert completed_since(TiedStub(), hours(150), kata_id(300))[0] == list(range(449, 300, -1))
+    assert completed_since(TiedStub(), hours(150), kata_id(301))[0] == list(range(449, 301, -1))
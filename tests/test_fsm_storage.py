@@ -0,0 +1,55 @@
+import uuid
+
+from aiogram.contrib.fsm_storage.redis import RedisStorage2
+
+from config import REDIS_DB, REDIS_HOST, REDIS_PASSWORD, REDIS_PORT
+from tests.conftest import run
+
+CHAT_ID, USER_ID = -1001, 1001
+
+
+def make_storage(prefix: str) -> RedisStorage2:
+    # configured the way bot.py does it
+    return RedisStorage2(REDIS_HOST, REDIS_PORT, db=REDIS_DB, password=REDIS_PASSWORD, prefix=prefix)
+
+
+async def close(storage: RedisStorage2):
+    await storage.close()
+    await storage.wait_closed()
+
+
+def test_state_survives_a_restart(redis):
+    async def main():
+        prefix = f'test-fsm-{uuid.uuid4().hex}'
+        storage = make_storage(prefix)
+        await storage.set_state(chat=CHAT_ID, user=USER_ID, state='Form:name')
+        await storage.set_data(chat=CHAT_ID, user=USER_ID, data={'cw_username': 'warrior'})
+        await close(storage)
+
+        storage = make_storage(prefix)
+        try:
+            assert await storage.get_state(chat=CHAT_ID, user=USER_ID) == 'Form:name'
+            assert await storage.get_data(chat=CHAT_ID, user=USER_ID) == {'cw_username': 'warrior'}
+            # other users of the chat have no state
+            assert await storage.get_state(chat=CHAT_ID, user=USER_ID + 1) is None
+        finally:
+            await storage.reset_all(full=False)
+            await close(storage)
+
+    run(main())
+
+
+def test_finish_clears_state_and_data(redis):
+    async def main():
+        storage = make_storage(f'test-fsm-{uuid.uuid4().hex}')
+        try:
+            await storage.set_state(chat=CHAT_ID, user=USER_ID, state='Form:name')
+            await storage.set_data(chat=CHAT_ID, user=USER_ID, data={'cw_username': 'warrior'})
+            await storage.finish(chat=CHAT_ID, user=USER_ID)
+            assert await storage.get_state(chat=CHAT_ID, user=USER_ID) is None
+            assert await storage.get_data(chat=CHAT_ID, user=USER_ID) == {}
+        finally:
+            await storage.reset_all(full=False)
+            await close(storage)
+
+    run(main())
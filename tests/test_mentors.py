@@ -0,0 +1,128 @@
+import collections
+import random
+import types
+
+import pytest
+
+from models import Chat, MenteeToMentor, Round, User
+from repository import user_repository
+from services import MentorService, round_cache
+from tests.conftest import database, run
+
+TG_ID_BASE = 2_100_001_000
+COHORT_ID = -1_002_100_001_000
+OTHER_COHORT_ID = COHORT_ID - 1
+
+
+def users(*tg_ids: int) -> list:
+    return [types.SimpleNamespace(tg_id=tg_id) for tg_id in tg_ids]
+
+
+@pytest.fixture
+def seeded():
+    state = random.getstate()
+    random.seed(1)
+    yield
+    random.setstate(state)
+
+
+def test_assignment_respects_mentor_capacity(seeded):
+    mentors, mentees = users(1, 2, 3), users(*range(10, 17))
+    for _ in range(50):
+        pairs = MentorService.assign_mentors(mentees, mentors, set())
+        assert sorted(mentee.tg_id for _, mentee in pairs) == list(range(10, 17))
+        loads = collections.Counter(mentor.tg_id for mentor, _ in pairs)
+        assert max(loads.values()) == 3
+
+
+def test_assignment_avoids_previous_pairs(seeded):
+    mentors, mentees = users(1, 2, 3), users(11, 12, 13)
+    # every mentee has been paired with every mentor but the one matching their id
+    history = {(mentor.tg_id, mentee.tg_id) for mentor in mentors for mentee in mentees
+               if mentee.tg_id - 10 != mentor.tg_id}
+    for _ in range(50):
+        pairs = MentorService.assign_mentors(mentees, mentors, history)
+        assert sorted((mentor.tg_id, mentee.tg_id) for mentor, mentee in pairs) == [(1, 11), (2, 12), (3, 13)]
+
+
+def test_assignment_falls_back_to_previous_pairs(seeded):
+    mentors, mentees = users(1, 2), users(11)
+    history = {(1, 11), (2, 11)}
+    for _ in range(20):
+        [(mentor, mentee)] = MentorService.assign_mentors(mentees, mentors, history)
+        assert mentee.tg_id == 11 and mentor.tg_id in (1, 2)
+
+
+def test_assignment_prefers_better_rated_mentors(seeded):
+    mentors, mentees = users(1, 2), users(11)
+    picks = collections.Counter(
+        MentorService.assign_mentors(mentees, mentors, set(), {1: 5.0, 2: 1.0})[0][0].tg_id
+        for _ in range(600))
+    # weights are proportional to the ratings, 5 to 1
+    assert 450 < picks[1] < 550
+
+
+def test_assignment_without_mentors_is_empty():
+    assert MentorService.assign_mentors(users(11), [], set()) == []
+
+
+async def create_cohorts():
+    for cohort_id in (COHORT_ID, OTHER_COHORT_ID):
+        await Chat.create(id=cohort_id, chat_type='supergroup')
+
+
+async def drop_cohorts():
+    await MenteeToMentor.delete.where(MenteeToMentor.cohort_id.in_([COHORT_ID, OTHER_COHORT_ID])).gino.status()
+    await Round.delete.where(Round.cohort_id.in_([COHORT_ID, OTHER_COHORT_ID])).gino.status()
+    await User.delete.where(User.tg_id.between(TG_ID_BASE, TG_ID_BASE + 99)).gino.status()
+    await Chat.delete.where(Chat.id.in_([COHORT_ID, OTHER_COHORT_ID])).gino.status()
+    await user_repository.invalidate(*range(TG_ID_BASE, TG_ID_BASE + 3))
+    await round_cache.delete(f'current:{COHORT_ID}', f'current:{OTHER_COHORT_ID}')
+
+
+async def pair(mentor: User, mentee: User, cohort_id: int):
+    round_ = await Round.create(cohort_id=cohort_id)
+    await MenteeToMentor.create(mentor_id=mentor.tg_id, mentee_id=mentee.tg_id,
+                                round_id=round_.id, cohort_id=cohort_id)
+
+
+def test_pair_from_another_cohort_does_not_block_an_assignment(postgres, redis):
+    async def main():
+        async with database():
+            await create_cohorts()
+            try:
+                first = await User.create(tg_id=TG_ID_BASE, is_mentor=True, cohort_id=COHORT_ID)
+                second = await User.create(tg_id=TG_ID_BASE + 1, is_mentor=True, cohort_id=COHORT_ID)
+                mentee = await User.create(tg_id=TG_ID_BASE + 2, is_mentor=False, cohort_id=COHORT_ID)
+                # the mentee studied with the first mentor in their previous cohort
+                await pair(first, mentee, OTHER_COHORT_ID)
+                await pair(second, mentee, COHORT_ID)
+
+                assert await MentorService.get_pair_history(COHORT_ID) == {(second.tg_id, mentee.tg_id)}
+                await MentorService.distribute_users(COHORT_ID)
+                mentor = await MentorService.get_current_mentor(mentee)
+                assert mentor.tg_id == first.tg_id
+            finally:
+                await drop_cohorts()
+
+    run(main())
+
+
+def test_becoming_a_mentor_in_a_group_joins_its_cohort(postgres, redis):
+    async def main():
+        async with database():
+            await create_cohorts()
+            try:
+                await User.create(tg_id=TG_ID_BASE, is_mentor=False, cohort_id=OTHER_COHORT_ID)
+                await MentorService.make_me_mentor(types.SimpleNamespace(id=TG_ID_BASE, username='old'), COHORT_ID)
+                await MentorService.make_me_mentor(types.SimpleNamespace(id=TG_ID_BASE + 1, username='new'), COHORT_ID)
+
+                for tg_id in (TG_ID_BASE, TG_ID_BASE + 1):
+                    user = await User.get(tg_id)
+                    assert (user.is_mentor, user.cohort_id) == (True, COHORT_ID)
+                assert {mentor.tg_id for mentor in await MentorService.get_mentors(COHORT_ID)} == {
+                    TG_ID_BASE, TG_ID_BASE + 1}
+            finally:
+                await drop_cohorts()
+
+    run(main())
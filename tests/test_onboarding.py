@@ -0,0 +1,93 @@
+import datetime
+
+from models import User
+from onboarding import MAX_TG_ID, ImportRow, InvalidRow, parse_row, parse_rows, upsert_users
+from tests.conftest import database, run
+
+TG_ID = 2_100_002_000
+
+CSV = """tg_id, tg_username, cw_username, is_mentor
+1,@alice,alice,yes
+2,,bob,
+"""
+
+NDJSON = """{"tg_id": 1, "tg_username": "@alice", "cw_username": "alice", "is_mentor": true}
+
+{"tg_id": "2", "cw_username": "bob"}
+"""
+
+
+def test_csv_rows_are_parsed():
+    rows, invalid = parse_rows(CSV)
+    assert rows == [ImportRow(2, 1, 'alice', 'alice', True), ImportRow(3, 2, None, 'bob', False)]
+    assert invalid == []
+
+
+def test_ndjson_rows_are_parsed():
+    rows, invalid = parse_rows(NDJSON)
+    assert rows == [ImportRow(1, 1, 'alice', 'alice', True), ImportRow(3, 2, None, 'bob', False)]
+    assert invalid == []
+
+
+def test_ndjson_line_that_is_not_an_object_is_reported():
+    rows, invalid = parse_rows('{"tg_id": 1, "cw_username": "alice"}\n[1, 2]\n{broken\n')
+    assert [row.tg_id for row in rows] == [1]
+    assert invalid == [InvalidRow(2, 'not a JSON object'), InvalidRow(3, 'not a JSON object')]
+
+
+def test_duplicate_tg_id_keeps_the_first_row():
+    rows, invalid = parse_rows('tg_id,cw_username\n1,alice\n1,bob\n')
+    assert [row.cw_username for row in rows] == ['alice']
+    assert invalid == [InvalidRow(3, 'tg_id 1 is listed twice')]
+
+
+def test_tg_id_out_of_range_is_rejected():
+    text = f'tg_id,cw_username\n0,zero\n-5,negative\n{MAX_TG_ID + 1},large\n{MAX_TG_ID},max\nabc,word\n'
+    rows, invalid = parse_rows(text)
+    assert [row.tg_id for row in rows] == [MAX_TG_ID]
+    assert invalid == [
+        InvalidRow(2, 'tg_id 0 is out of range'),
+        InvalidRow(3, 'tg_id -5 is out of range'),
+        InvalidRow(4, f'tg_id {MAX_TG_ID + 1} is out of range'),
+        InvalidRow(6, "tg_id must be a number, got 'abc'"),
+    ]
+
+
+def test_is_mentor_values():
+    for value, expected in [(True, True), ('Yes', True), (' 1 ', True), ('t', True),
+                            (False, False), (None, False), ('', False), ('No', False), ('0', False)]:
+        assert parse_row(1, {'tg_id': 1, 'cw_username': 'alice', 'is_mentor': value}).is_mentor is expected
+
+
+def test_bad_is_mentor_value_is_reported():
+    rows, invalid = parse_rows('tg_id,cw_username,is_mentor\n1,alice,maybe\n2,bob,true\n')
+    assert [row.tg_id for row in rows] == [2]
+    assert invalid == [InvalidRow(2, "is_mentor must be true or false, got 'maybe'")]
+
+
+def test_missing_cw_username_is_reported():
+    assert parse_rows('tg_id,cw_username\n1, \n')[1] == [InvalidRow(2, 'cw_username is missing')]
+
+
+def test_cursor_is_reset_when_the_codewars_username_changes(postgres, redis):
+    completed_at = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+
+    async def main():
+        async with database():
+            for offset, cw_username in enumerate(['same', 'before']):
+                await User.create(tg_id=TG_ID + offset, cw_username=cw_username,
+                                  last_completed_at=completed_at, last_completed_kata_id='kata')
+            try:
+                stored = await upsert_users([
+                    ImportRow(2, TG_ID, None, 'same', False),
+                    ImportRow(3, TG_ID + 1, None, 'after', False),
+                ])
+                assert stored == 2
+                same, changed = await User.get(TG_ID), await User.get(TG_ID + 1)
+                assert (same.last_completed_at, same.last_completed_kata_id) == (completed_at, 'kata')
+                assert (changed.cw_username, changed.last_completed_at, changed.last_completed_kata_id) == (
+                    'after', None, None)
+            finally:
+                await User.delete.where(User.tg_id.in_([TG_ID, TG_ID + 1])).gino.status()
+
+    run(main())
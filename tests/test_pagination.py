@@ -0,0 +1,79 @@
+import html
+import types
+
+import pytest
+from tabulate import tabulate
+
+from services import PAGE_SIZE, MentorService, UserService
+from tests.conftest import run
+
+KATA_IDS = [f'kata{num:02}' for num in range(25)]
+
+
+@pytest.fixture(autouse=True)
+def unsolved(monkeypatch):
+    async def get_unsolved_katas(user_id: int, refresh: bool = False):
+        return [{'id': kata_id, 'name': kata_id, 'slug': kata_id} for kata_id in KATA_IDS]
+
+    monkeypatch.setattr(UserService, 'get_unsolved_katas', staticmethod(get_unsolved_katas))
+
+
+def page(cursor: str = None):
+    """
+    Kata ids of the page and the callback data of its navigation buttons
+    """
+    markup, total = run(UserService.get_missing_katas(types.SimpleNamespace(id=1), cursor))
+    assert total == len(KATA_IDS)
+    buttons = [button for row in markup.inline_keyboard for button in row]
+    return ([button.text for button in buttons if button.url],
+            [button.callback_data for button in buttons if button.callback_data])
+
+
+def test_first_page_only_links_forward():
+    assert page() == (KATA_IDS[:PAGE_SIZE], ['next_>kata09'])
+
+
+def test_next_page_starts_after_the_cursor():
+    assert page('>kata09') == (KATA_IDS[10:20], ['next_>kata19', 'next_<kata10'])
+
+
+def test_previous_page_ends_before_the_cursor():
+    assert page('<kata10') == (KATA_IDS[:PAGE_SIZE], ['next_>kata09'])
+    assert page('<kata20') == (KATA_IDS[10:20], ['next_>kata19', 'next_<kata10'])
+
+
+def test_last_page_only_links_back():
+    assert page('>kata19') == (KATA_IDS[20:], ['next_<kata20'])
+
+
+def test_cursor_of_a_kata_solved_meanwhile_lands_next_to_it():
+    # kata09.5 sorts between kata09 and kata10 as if it had just been solved
+    assert page('>kata09.5') == (KATA_IDS[10:20], ['next_>kata19', 'next_<kata10'])
+    assert page('<kata09.5') == (KATA_IDS[:PAGE_SIZE], ['next_>kata09'])
+
+
+def test_cursor_past_the_end_gives_an_empty_page():
+    assert page('>kata99') == ([], [])
+
+
+def test_short_table_is_a_single_message():
+    assert MentorService.split_table('a <b>\nc') == ['<pre>a &lt;b&gt;\nc</pre>']
+
+
+def test_long_table_is_split_repeating_the_header():
+    rows = [(num, f'<mentor{num}>', f'mentee&{num}') for num in range(1, 400)]
+    table = tabulate(rows, headers=['#', 'Mentor', 'Mentee'], tablefmt='pretty')
+    lines = table.split('\n')
+    header, footer = [html.escape(line) for line in lines[:3]], html.escape(lines[-1])
+
+    chunks = MentorService.split_table(table)
+    assert len(chunks) > 1
+    body = []
+    for chunk in chunks:
+        assert len(chunk) <= 4096
+        assert chunk.startswith('<pre>') and chunk.endswith('</pre>')
+        chunk_lines = chunk[len('<pre>'):-len('</pre>')].split('\n')
+        assert chunk_lines[:3] == header and chunk_lines[-1] == footer
+        body.extend(chunk_lines[3:-1])
+    assert body == [html.escape(line) for line in lines[3:-1]]
+    assert '&lt;mentor1&gt;' in chunks[0] and 'mentee&amp;1' in chunks[0]
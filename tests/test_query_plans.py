@@ -0,0 +1,184 @@
+"""
+Plan regression checks of the hot queries.
+
+A realistic amount of users, katas, solutions and shuffle rounds is seeded
+in a transaction that is rolled back afterwards, and every hot query must
+be served by the index meant for it.
+"""
+import json
+import typing
+
+import pytest
+
+from models import db
+from tests.conftest import database, run
+
+TG_ID_BASE = 2_100_000_000
+ROUND_ID_BASE = 2_100_000_000
+# chat id of the first seeded cohort, the others count down from it
+COHORT_ID = -1_002_100_000_000
+COHORTS = 8
+# users and mentors of every cohort
+USERS = 100
+MENTORS = 10
+KATAS = 3000
+SOLVED_PER_USER = 300
+ROUNDS = 150
+
+# (description, query, arguments, index expected in the plan)
+CHECKS = [
+    (
+        'current mentor of a mentee',
+        """
+        SELECT mentor.tg_id, mentor.tg_username
+        FROM pairs
+        INNER JOIN users AS mentor
+            ON mentor.tg_id = pairs.mentor_id
+        WHERE pairs.mentee_id = $1 AND pairs.round_id = $2;
+        """,
+        (TG_ID_BASE + MENTORS, ROUND_ID_BASE + ROUNDS - 1),
+        'ix_pairs_round_id_mentee_id',
+    ),
+    (
+        'current round of a cohort',
+        """
+        SELECT max(rounds.id) AS max_1
+        FROM rounds
+        WHERE rounds.cohort_id = $1;
+        """,
+        (COHORT_ID,),
+        'ix_rounds_cohort_id_id',
+    ),
+    (
+        'pair history of a cohort',
+        """
+        SELECT DISTINCT pairs.mentor_id, pairs.mentee_id
+        FROM pairs
+        WHERE pairs.cohort_id = $1;
+        """,
+        (COHORT_ID,),
+        'ix_pairs_cohort_id_mentee_id_mentor_id',
+    ),
+    (
+        'leaderboard of a cohort',
+        """
+        SELECT users.cw_username, COUNT('solved.id')
+        FROM solved_katas AS solved
+        INNER JOIN users
+            ON users.tg_id = solved.user_id
+        WHERE users.cohort_id = $1 AND solved.kata_id IN (SELECT id FROM katas)
+        GROUP BY users.cw_username
+        ORDER BY COUNT('solved.id') DESC;
+        """,
+        (COHORT_ID,),
+        'ix_users_cohort_id_is_mentor',
+    ),
+    (
+        'mentees to remind of the current round',
+        """
+        SELECT pairs.mentee_id, mentor.tg_username
+        FROM pairs
+        INNER JOIN users AS mentor
+            ON mentor.tg_id = pairs.mentor_id
+        INNER JOIN users AS mentee
+            ON mentee.tg_id = pairs.mentee_id
+        WHERE mentee.is_mentor = false AND pairs.round_id IN (
+            SELECT MAX(id)
+            FROM rounds
+            GROUP BY cohort_id
+        );
+        """,
+        (),
+        'ix_pairs_round_id_mentor_id',
+    ),
+    (
+        'unsolved katas of a user',
+        """
+        SELECT katas.id, katas.name, katas.slug
+        FROM katas
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM solved_katas
+            WHERE solved_katas.user_id = $1
+                AND solved_katas.kata_id = katas.id
+        )
+        ORDER BY katas.id COLLATE "C";
+        """,
+        (TG_ID_BASE + MENTORS,),
+        'uq_solved_katas_user_id_kata_id',
+    ),
+]
+
+
+def index_names(plan: dict) -> typing.Iterator[str]:
+    if 'Index Name' in plan:
+        yield plan['Index Name']
+    for child in plan.get('Plans', []):
+        yield from index_names(child)
+
+
+async def seed(conn):
+    await conn.execute("""
+        INSERT INTO chats (id, chat_type)
+        SELECT $1::bigint - cohort, 'supergroup'
+        FROM generate_series(0, $2 - 1) AS cohort;
+    """, COHORT_ID, COHORTS)
+    await conn.execute("""
+        INSERT INTO users (tg_id, tg_username, cw_username, is_mentor, cohort_id)
+        SELECT $1 + cohort * $3 + num, 'user' || num, 'user' || num, num < $2, $4::bigint - cohort
+        FROM generate_series(0, $5 - 1) AS cohort, generate_series(0, $3 - 1) AS num;
+    """, TG_ID_BASE, MENTORS, USERS, COHORT_ID, COHORTS)
+    await conn.execute("""
+        INSERT INTO katas (id, name, slug)
+        SELECT 'explain' || num, 'Kata ' || num, 'kata-' || num
+        FROM generate_series(0, $1 - 1) AS num;
+    """, KATAS)
+    await conn.execute("""
+        INSERT INTO solved_katas (user_id, kata_id)
+        SELECT $1 + num, 'explain' || ((num * 7 + kata) % $3)
+        FROM generate_series(0, $2 - 1) AS num, generate_series(0, $4 - 1) AS kata;
+    """, TG_ID_BASE, USERS * COHORTS, KATAS, SOLVED_PER_USER)
+    await conn.execute("""
+        INSERT INTO rounds (id, cohort_id)
+        SELECT $1 + cohort * $2 + rnd, $3::bigint - cohort
+        FROM generate_series(0, $4 - 1) AS cohort, generate_series(0, $2 - 1) AS rnd;
+    """, ROUND_ID_BASE, ROUNDS, COHORT_ID, COHORTS)
+    await conn.execute("""
+        INSERT INTO pairs (mentor_id, mentee_id, round_id, cohort_id)
+        SELECT $1 + cohort * $3 + (mentee + rnd) % $2, $1 + cohort * $3 + mentee,
+            $5 + cohort * $4 + rnd, $6::bigint - cohort
+        FROM generate_series(0, $7 - 1) AS cohort,
+            generate_series($2, $3 - 1) AS mentee,
+            generate_series(0, $4 - 1) AS rnd;
+    """, TG_ID_BASE, MENTORS, USERS, ROUNDS, ROUND_ID_BASE, COHORT_ID, COHORTS)
+    await conn.execute("ANALYZE chats, users, katas, solved_katas, rounds, pairs;")
+
+
+async def explain_checks() -> typing.Dict[str, typing.Set[str]]:
+    """
+    Indexes used by the plan of every check, keyed by its description
+    """
+    async with database():
+        async with db.acquire() as conn:
+            raw = conn.raw_connection
+            transaction = raw.transaction()
+            await transaction.start()
+            try:
+                await seed(raw)
+                used = {}
+                for description, query, args, _ in CHECKS:
+                    plan = json.loads(await raw.fetchval(f'EXPLAIN (FORMAT JSON) {query}', *args))
+                    used[description] = set(index_names(plan[0]['Plan']))
+                return used
+            finally:
+                await transaction.rollback()
+
+
+@pytest.fixture(scope='module')
+def plans(postgres):
+    return run(explain_checks())
+
+
+@pytest.mark.parametrize('description, index', [(check[0], check[3]) for check in CHECKS])
+def test_hot_query_uses_its_index(plans, description, index):
+    assert index in plans[description]
@@ -0,0 +1,101 @@
+import asyncio
+import uuid
+
+from cache import get_redis
+from singleflight import SingleFlight
+from tests.conftest import run
+
+
+def make_flight(**kwargs) -> SingleFlight:
+    return SingleFlight(f'test-{uuid.uuid4().hex}', **kwargs)
+
+
+def test_lock_is_held_during_the_call_and_released(redis):
+    async def main():
+        redis = await get_redis()
+        flight = make_flight(lock_ttl=30)
+        lock_key = f'lock:{flight.namespace}:key'
+
+        async def fn():
+            assert await redis.get(lock_key) is not None
+            assert 0 < await redis.pttl(lock_key) <= 30_000
+            return 'done'
+
+        assert await flight.do('key', fn) == 'done'
+        assert await redis.get(lock_key) is None
+
+    run(main())
+
+
+def test_release_keeps_a_lock_taken_over_by_another_replica(redis):
+    async def main():
+        redis = await get_redis()
+        flight = make_flight()
+        lock_key = f'lock:{flight.namespace}:key'
+
+        async def fn():
+            # the lock expired and another replica took it
+            await redis.set(lock_key, 'other')
+
+        await flight.do('key', fn)
+        assert await redis.get(lock_key, encoding='utf8') == 'other'
+        await redis.delete(lock_key)
+
+    run(main())
+
+
+def test_replicas_run_one_after_another(redis):
+    async def main():
+        namespace = f'test-{uuid.uuid4().hex}'
+        # flights don't share in-process calls, like two bot processes
+        replicas = [SingleFlight(namespace, poll_interval=0.01) for _ in range(3)]
+        running, overlaps = 0, 0
+
+        async def fn():
+            nonlocal running, overlaps
+            running += 1
+            overlaps += running > 1
+            await asyncio.sleep(0.05)
+            running -= 1
+            return 'done'
+
+        results = await asyncio.gather(*[replica.do('key', fn) for replica in replicas])
+        assert results == ['done'] * 3
+        assert overlaps == 0
+
+    run(main())
+
+
+def test_concurrent_calls_in_one_process_share_the_call(redis):
+    async def main():
+        flight = make_flight()
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return calls
+
+        assert await asyncio.gather(*[flight.do('key', fn) for _ in range(5)]) == [1] * 5
+        assert calls == 1
+
+    run(main())
+
+
+def test_gives_up_waiting_for_a_stuck_lock(redis):
+    async def main():
+        redis = await get_redis()
+        flight = make_flight(lock_ttl=0.3, poll_interval=0.05)
+        lock_key = f'lock:{flight.namespace}:key'
+        await redis.set(lock_key, 'other', pexpire=60_000)
+
+        async def fn():
+            return 'done'
+
+        assert await flight.do('key', fn) == 'done'
+        # not its lock, so it isn't released
+        assert await redis.get(lock_key, encoding='utf8') == 'other'
+        await redis.delete(lock_key)
+
+    run(main())
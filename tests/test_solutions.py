@@ -0,0 +1,35 @@
+import uuid
+
+from catalogue import credit_pending_solves, upsert_katas
+from models import Kata, PendingSolvedKata, SolvedKata, User
+from services import UserService
+from tests.conftest import database, run
+
+TG_ID = 2_100_000_500
+
+
+def test_completions_of_unknown_katas_are_credited_once_indexed(postgres, redis):
+    prefix = f'test-{uuid.uuid4().hex[:8]}'
+    known, unknown = f'{prefix}-known', f'{prefix}-unknown'
+
+    async def main():
+        async with database():
+            user = await User.create(tg_id=TG_ID, cw_username='warrior')
+            try:
+                await upsert_katas([{'id': known, 'name': 'Known', 'slug': 'known'}])
+                assert await UserService.save_solved_katas(user, [known, unknown, unknown]) == 1
+                pending = await PendingSolvedKata.query.where(PendingSolvedKata.user_id == TG_ID).gino.all()
+                assert [row.kata_id for row in pending] == [unknown]
+
+                await upsert_katas([{'id': unknown, 'name': 'Unknown', 'slug': 'unknown'}])
+                assert await credit_pending_solves() == 1
+                solved = await SolvedKata.query.where(SolvedKata.user_id == TG_ID).gino.all()
+                assert sorted(row.kata_id for row in solved) == [known, unknown]
+                assert await PendingSolvedKata.query.where(PendingSolvedKata.user_id == TG_ID).gino.all() == []
+            finally:
+                await SolvedKata.delete.where(SolvedKata.user_id == TG_ID).gino.status()
+                await PendingSolvedKata.delete.where(PendingSolvedKata.user_id == TG_ID).gino.status()
+                await user.delete()
+                await Kata.delete.where(Kata.id.like(f'{prefix}-%')).gino.status()
+
+    run(main())
@@ -0,0 +1,21 @@
+import asyncio
+
+
+class RateLimiter:
+    """
+    Spaces out calls so that at most ``rate`` of them start per second
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_slot = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = asyncio.get_event_loop().time()
+        slot = max(now, self._next_slot)
+        # the slot is reserved before sleeping, so concurrent callers queue up
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
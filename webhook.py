@@ -0,0 +1,139 @@
+"""
+Webhook serving mode.
+
+Updates posted by Telegram are acknowledged right away and handed to an
+``UpdateWorkerPool`` which runs a bounded number of handlers at once while
+keeping the updates of every chat in order.
+"""
+import asyncio
+import typing
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+from loguru import logger
+
+from config import (WEBHOOK_CONCURRENCY, WEBHOOK_DRAIN_TIMEOUT, WEBHOOK_MAX_PENDING, WEBHOOK_PATH,
+                    WEBHOOK_URL)
+from metrics import handle_metrics
+
+
+def chat_key(update: types.Update) -> int:
+    """
+    Key of the chat an update belongs to, updates sharing it are processed in order
+    """
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message is not None:
+            return message.chat.id
+    if update.callback_query is not None:
+        callback_query = update.callback_query
+        if callback_query.message is not None:
+            return callback_query.message.chat.id
+        return callback_query.from_user.id
+    return update.update_id
+
+
+class UpdateWorkerPool:
+    """
+    Runs at most ``limit`` update handlers at once, one chat at a time
+    """
+
+    def __init__(self, dispatcher: Dispatcher, limit: int = WEBHOOK_CONCURRENCY,
+                 max_pending: int = WEBHOOK_MAX_PENDING):
+        self.dispatcher = dispatcher
+        self.limit = limit
+        self.max_pending = max_pending
+        self.closing = False
+        self._semaphore: typing.Optional[asyncio.Semaphore] = None
+        self._tails: typing.Dict[int, asyncio.Task] = {}
+        self._tasks: typing.Set[asyncio.Task] = set()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    @property
+    def is_full(self) -> bool:
+        return len(self._tasks) >= self.max_pending
+
+    def submit(self, update: types.Update):
+        key = chat_key(update)
+        # chain the update after the previous one of the same chat
+        task = asyncio.ensure_future(self._process(update, self._tails.get(key)))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._forget(key, done))
+
+    async def _process(self, update: types.Update, previous: typing.Optional[asyncio.Task]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with self.semaphore:
+            # request handlers don't inherit the context set up on startup
+            Bot.set_current(self.dispatcher.bot)
+            Dispatcher.set_current(self.dispatcher)
+            try:
+                await self.dispatcher.process_update(update)
+            except Exception:
+                logger.exception("Failed to process update {}", update.update_id)
+
+    def _forget(self, key: int, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        """
+        Stop accepting updates and wait for the ones in flight
+        """
+        self.closing = True
+        if self._tasks:
+            logger.info("Draining {} updates", len(self._tasks))
+            _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+
+
+async def handle_update(request: web.Request) -> web.Response:
+    pool: UpdateWorkerPool = request.app['pool']
+    if pool.closing or pool.is_full:
+        # Telegram redelivers the update later
+        return web.Response(status=503)
+    update = types.Update(**await request.json())
+    pool.submit(update)
+    return web.Response()
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    pool: UpdateWorkerPool = request.app['pool']
+    status = 503 if pool.closing else 200
+    return web.json_response({'closing': pool.closing, 'in_flight': len(pool)}, status=status)
+
+
+def make_app(dispatcher: Dispatcher,
+             on_startup: typing.Callable[[Dispatcher], typing.Awaitable],
+             on_shutdown: typing.Callable[[Dispatcher], typing.Awaitable]) -> web.Application:
+    app = web.Application()
+    app['pool'] = UpdateWorkerPool(dispatcher)
+
+    async def startup(app: web.Application):
+        await on_startup(dispatcher)
+        await dispatcher.bot.set_webhook(WEBHOOK_URL)
+
+    async def shutdown(app: web.Application):
+        await app['pool'].drain()
+
+    async def cleanup(app: web.Application):
+        await on_shutdown(dispatcher)
+        await (await dispatcher.bot.get_session()).close()
+
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get('/health', handle_health)
+    app.router.add_get('/metrics', handle_metrics)
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    app.on_cleanup.append(cleanup)
+    return app